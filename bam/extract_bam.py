@@ -1,15 +1,25 @@
 #!/usr/bin/env python
 
-import pysam
 import argparse
 import collections
 import pandas as pd
 from collections import defaultdict
 import numpy as np
+import os
+import sys
+if not __package__:
+    # run as a file from a checkout, put the repo root on the path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bam.extract_bam_summary import (read_bed,
+                                     open_alignment_file,
+                                     add_reference_args,
+                                     set_ref_cache)
 
 def main():
     args = parse_args()
-    run(args.bam_file, args.bed_file, args.sample_name, args.out_dir)
+    set_ref_cache(args.ref_cache)
+    run(args.bam_file, args.bed_file, args.sample_name, args.out_dir,
+        args.reference)
 
 
 def parse_args():
@@ -18,7 +28,7 @@ def parse_args():
     """
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('-i', dest='bam_file',
-                       help='bam file',
+                       help='bam or cram file',
                        required=True)
     parser.add_argument('-s', dest='sample_name',
                        help='sample name',
@@ -29,41 +39,30 @@ def parse_args():
     parser.add_argument('-o', dest='out_dir', 
                         help="out dir", 
                         required=True)
+    add_reference_args(parser)
     args = parser.parse_args()
     return args
 
 
-def run(bam_file, bed_file, sample_name, out_dir):
+def run(bam_file, bed_file, sample_name, out_dir, reference=None):
     bed_list = read_bed(bed_file)
-    bam_bed_dict, raw_count_dict = index_out_bam(bam_file, bed_list)
+    bam_bed_dict, raw_count_dict = index_out_bam(bam_file, bed_list, reference)
     create_file = create_dataframe(bam_bed_dict, 
                                    sample_name, 
                                    out_dir, raw_count_dict)
 
 
-def read_bed(bed_file):
-    bed_file_list = []
-    f = bed_file.readlines()
-    for raw_line in f:
-        value = raw_line.strip().split('\t')
-        chrom = value[0].strip()
-        start =  value[1].strip()
-        stop = value[2].strip()
-        string = [chrom, start, stop]
-        bed_file_list.append(string)
-    return bed_file_list
-
 def generate_list(bed_list):
     for i in bed_list:
         yield i
 
 
-def index_out_bam(bam_file, bed_list):
+def index_out_bam(bam_file, bed_list, reference=None):
     bed_metrics_dict = defaultdict(list)
     read_depth_dict = {}
     for i in generate_list(bed_list):
         string = i[0] + "_" + i[1] + "_"+  i[2]
-        samfile = pysam.AlignmentFile(bam_file, "rb", check_sq=False)
+        samfile = open_alignment_file(bam_file, reference)
         count=0
         chrom = str(i[0]).strip()
         start = int(i[1])
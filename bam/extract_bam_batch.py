@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+This script extracts the bam metrics of
+many samples against one bed file, the
+probe set is parsed once and the samples
+are written to a single combined table
+"""
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from bam.extract_bam_summary import (ScanConfig,
+                                     DEFAULT_TAGS,
+                                     parse_tags,
+                                     add_sampling_args,
+                                     add_reference_args,
+                                     set_ref_cache,
+                                     skip_flags,
+                                     read_bed,
+                                     group_probes,
+                                     scan_probes,
+                                     build_dataframe)
+from pipeline.table_io import add_format_arg, TableWriter
+
+_probe_set = None
+_config = None
+
+
+def main():
+    args = parse_args()
+    set_ref_cache(args.ref_cache)
+    run(args.manifest,
+        args.bed_file,
+        args.outname,
+        args.processes,
+        args.threads,
+        ScanConfig(tags=args.tags,
+                   max_reads=args.max_reads,
+                   skip_flags=skip_flags(args.skip),
+                   reference=args.reference),
+        args.table_format)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-m', dest='manifest',
+                        help="tab separated manifest of sample name and bam or cram path, one sample per line",
+                        required=True)
+    parser.add_argument('-b', dest='bed_file', type=argparse.FileType('r'),
+                        help="bed file",
+                        required=True)
+    parser.add_argument('-o', dest='outname',
+                        help="name of the combined metrics file",
+                        required=True)
+    parser.add_argument('-p', '--processes', dest='processes', type=int,
+                        help="number of samples extracted in parallel",
+                        default=1)
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        help="bgzf decompression threads per bam handle",
+                        default=1)
+    parser.add_argument('--tags', dest='tags', type=parse_tags,
+                        help="comma separated aux tags to extract",
+                        default=DEFAULT_TAGS)
+    add_sampling_args(parser)
+    add_reference_args(parser)
+    add_format_arg(parser)
+    args = parser.parse_args()
+    return args
+
+
+def run(manifest, bed_file, outname, processes=1, threads=1,
+        config=ScanConfig(), table_format='csv'):
+    samples = read_manifest(manifest)
+    bed_list = read_bed(bed_file)
+    probe_set = group_probes(bed_list)
+    extract_samples(samples, probe_set, outname, processes, threads, config,
+                    table_format)
+
+
+def read_manifest(manifest):
+    """
+    sample name and bam path per line, a line with
+    only a bam path uses the file name as sample name
+    """
+    samples = []
+    with open(manifest) as fh:
+        for raw_line in fh:
+            value = raw_line.strip().split('\t')
+            if not value[0] or value[0].startswith('#'):
+                continue
+            if len(value) == 1:
+                samples.append((os.path.basename(value[0]), value[0]))
+            else:
+                samples.append((value[0].strip(), value[1].strip()))
+    return samples
+
+
+def _init_worker(probe_set, config):
+    global _probe_set, _config
+    _probe_set = probe_set
+    _config = config
+
+
+def extract_sample(sample, threads=1):
+    sample_name, bam_file = sample
+    chrom_dict, probe_order = _probe_set
+    bam_bed_dict, raw_count_dict = scan_probes(bam_file, chrom_dict,
+                                               probe_order,
+                                               threads=threads,
+                                               config=_config)
+    return build_dataframe(bam_bed_dict, sample_name, raw_count_dict, _config)
+
+
+def extract_samples(samples, probe_set, outname, processes=1, threads=1,
+                    config=ScanConfig(), table_format='csv'):
+    """
+    fan the samples out over a process pool and append
+    each finished sample to the combined table in
+    manifest order
+    """
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_init_worker,
+                             initargs=(probe_set, config)) as executor:
+        results = executor.map(extract_sample, samples,
+                               [threads] * len(samples))
+        with TableWriter(outname, table_format) as writer:
+            for df in results:
+                writer.write(df)
+
+
+if __name__ == "__main__":
+    main()
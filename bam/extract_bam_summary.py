@@ -3,13 +3,56 @@
 import pysam
 import argparse
 import collections
+import math
+import os
+import random
+import zlib
 import pandas as pd
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
+import sys
+if not __package__:
+    # run as a file from a checkout, put the repo root on the path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bed.bed_reader import iter_bed_chunks
+from pipeline.table_io import add_format_arg, table_suffix, write_table
+
+SCAN_GAP = 1000
+SHARDS_PER_PROCESS = 4
+READ_FIELDS = ('isize', 'proper_pair', 'MAPQ')
+DEFAULT_TAGS = ('AS', 'XS', 'MQ')
+
+# SAM spec tags of type A, Z, H or B and the bwa XA and XT,
+# their values cannot go into the numeric metrics
+STRING_TAGS = frozenset(['BC', 'BQ', 'BZ', 'CB', 'CO', 'CR', 'CS', 'CT', 'CY',
+                         'E2', 'FZ', 'LB', 'MC', 'MD', 'MI', 'ML', 'MM', 'OA',
+                         'OC', 'OQ', 'OX', 'PG', 'PT', 'PU', 'Q2', 'QT', 'QX',
+                         'R2', 'RG', 'RX', 'SA', 'TS', 'U2', 'XA', 'XT'])
+
+FLAG_FILTERS = {'duplicates': 0x400,
+                'secondary': 0x100,
+                'supplementary': 0x800,
+                'qcfail': 0x200}
+
+# htslib SAM_FLAG | SAM_RNAME | SAM_POS | SAM_MAPQ | SAM_CIGAR | SAM_TLEN | SAM_AUX,
+# cram decoding skips read names, mate fields, sequence and qualities
+CRAM_REQUIRED_FIELDS = 0x2 | 0x4 | 0x8 | 0x10 | 0x20 | 0x100 | 0x800
+
+ScanConfig = collections.namedtuple('ScanConfig',
+                                    ['tags', 'max_reads', 'skip_flags', 'reference'],
+                                    defaults=[DEFAULT_TAGS, None, 0, None])
 
 def main():
     args = parse_args()
-    run(args.bam_file, args.bed_file, args.sample_name, args.out_dir)
+    set_ref_cache(args.ref_cache)
+    config = ScanConfig(tags=args.tags,
+                        max_reads=args.max_reads,
+                        skip_flags=skip_flags(args.skip),
+                        reference=args.reference)
+    run(args.bam_file, args.bed_file, args.sample_name, args.out_dir,
+        args.processes, args.threads, config, args.table_format)
 
 
 def parse_args():
@@ -18,7 +61,7 @@ def parse_args():
     """
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('-i', dest='bam_file',
-                       help='bam file',
+                       help='bam or cram file',
                        required=True)
     parser.add_argument('-s', dest='sample_name',
                        help='sample name',
@@ -29,28 +72,105 @@ def parse_args():
     parser.add_argument('-o', dest='out_dir', 
                         help="out dir", 
                         required=True)
+    parser.add_argument('-p', '--processes', dest='processes', type=int,
+                        help="number of worker processes, probes are sharded across them",
+                        default=1)
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        help="bgzf decompression threads per bam handle",
+                        default=1)
+    parser.add_argument('--tags', dest='tags', type=parse_tags,
+                        help="comma separated aux tags to extract",
+                        default=DEFAULT_TAGS)
+    add_sampling_args(parser)
+    add_reference_args(parser)
+    add_format_arg(parser)
     args = parser.parse_args()
     return args
 
 
-def run(bam_file, bed_file, sample_name, out_dir):
+def parse_tags(value):
+    """
+    comma separated aux tags, only numeric tags can be
+    summarised
+    """
+    tags = tuple(tag.strip() for tag in value.split(',') if tag.strip())
+    for tag in tags:
+        if len(tag) != 2 or not tag[0].isalpha() or not tag.isalnum():
+            raise argparse.ArgumentTypeError("{0} is not a sam aux tag".format(tag))
+        if tag in STRING_TAGS:
+            raise argparse.ArgumentTypeError("{0} is not a numeric tag".format(tag))
+    return tags
+
+
+def add_sampling_args(parser):
+    parser.add_argument('--max-reads', dest='max_reads', type=int,
+                        help="reservoir sample at most this many reads per probe, raw_dp stays the true count",
+                        default=None)
+    parser.add_argument('--skip', dest='skip', action='append',
+                        choices=sorted(FLAG_FILTERS),
+                        help="drop reads with this flag from the metrics, can be repeated",
+                        default=[])
+
+
+def add_reference_args(parser):
+    parser.add_argument('-r', '--reference', dest='reference',
+                        help="reference fasta, required to decode cram input",
+                        default=None)
+    parser.add_argument('--ref-cache', dest='ref_cache',
+                        help="local cache directory for cram reference sequences",
+                        default=None)
+
+
+def set_ref_cache(ref_cache):
+    """
+    point htslib at a local reference cache, worker
+    processes inherit it through the environment
+    """
+    if ref_cache:
+        os.makedirs(ref_cache, exist_ok=True)
+        os.environ['REF_CACHE'] = os.path.join(ref_cache, '%2s', '%2s', '%s')
+
+
+def open_alignment_file(bam_file, reference=None, threads=1):
+    """
+    open a bam or cram, cram only decodes the fields
+    the extractor reads
+    """
+    if bam_file.endswith('.cram'):
+        return pysam.AlignmentFile(bam_file, "rc", check_sq=False,
+                                   reference_filename=reference,
+                                   threads=threads,
+                                   format_options=["required_fields=" + hex(CRAM_REQUIRED_FIELDS),
+                                                   "decode_md=0"])
+    return pysam.AlignmentFile(bam_file, "rb", check_sq=False,
+                               threads=threads)
+
+
+def skip_flags(skip):
+    mask = 0
+    for name in skip:
+        mask |= FLAG_FILTERS[name]
+    return mask
+
+
+def run(bam_file, bed_file, sample_name, out_dir, processes=1, threads=1,
+        config=ScanConfig(), table_format='csv'):
     bed_list = read_bed(bed_file)
-    bam_bed_dict, raw_count_dict = index_out_bam(bam_file, bed_list)
+    bam_bed_dict, raw_count_dict = index_out_bam(bam_file, bed_list,
+                                                 processes, threads, config)
     create_file = create_dataframe(bam_bed_dict, 
                                    sample_name, 
-                                   out_dir, raw_count_dict)
+                                   out_dir, raw_count_dict,
+                                   table_format, config)
 
 
 def read_bed(bed_file):
     bed_file_list = []
-    f = bed_file.readlines()
-    for raw_line in f:
-        value = raw_line.strip().split('\t')
-        chrom = value[0].strip()
-        start =  value[1].strip()
-        stop = value[2].strip()
-        string = [chrom, start, stop]
-        bed_file_list.append(string)
+    for chunk in iter_bed_chunks(bed_file, add_chr=False):
+        for chrom, start, stop in zip(chunk['chrom'].values,
+                                      chunk['start'].values,
+                                      chunk['end'].values):
+            bed_file_list.append([chrom, str(start), str(stop)])
     return bed_file_list
 
 def generate_list(bed_list):
@@ -58,77 +178,329 @@ def generate_list(bed_list):
         yield i
 
 
-def index_out_bam(bam_file, bed_list):
-    bed_metrics_dict = defaultdict(list)
-    read_depth_dict = {}
+def group_probes(bed_list):
+    """
+    group the probes by chromosome, sorted by start
+    """
+    chrom_dict = defaultdict(list)
+    probe_order = {}
     for i in generate_list(bed_list):
         string = i[0] + "_" + i[1] + "_"+  i[2]
-        samfile = pysam.AlignmentFile(bam_file, "rb", check_sq=False)
-        count=0
+        if string in probe_order:
+            continue
+        probe_order[string] = True
         chrom = str(i[0]).strip()
-        start = int(i[1])
-        stop = int(i[2])
-        for read in samfile.fetch(str(chrom), start, stop):
-            count+=1
-            mapq = read.mapping_quality
-            if read.is_proper_pair:
-                isize = read.template_length
-                isize_dict = {'isize' : isize, 'proper_pair': 1, 'MAPQ' : mapq}
-                tag_dict = dict(read.get_tags())
-                try:
-                    new_tag = {k: tag_dict[k] for k in ('AS', 'XS', 'MQ')}
-                    new_tag_update = dict(list(isize_dict.items()) + list(new_tag.items()))
-                    bed_metrics_dict[string].append(new_tag_update)
-                except KeyError:
-                    try:
-                        new_tag = {k: tag_dict[k] for k in ('AS', 'XS')}
-                        new_tag_update = dict(list(isize_dict.items()) + list(new_tag.items()))
-                        bed_metrics_dict[string].append(new_tag_update)
-                    except KeyError:
-                        new_tag = {k: tag_dict[k] for k in ('AS')}
-                        new_tag_update = dict(list(isize_dict.items()) + list(new_tag.items()))
-                        bed_metrics_dict[string].append(new_tag_update)
-            else:
-                isize = read.template_length
-                isize_dict = {'isize' : isize, 'proper_pair': 0, 'MAPQ' : mapq}
-                tag_dict = dict(read.get_tags())
-                try:
-                    new_tag = {k: tag_dict[k] for k in ('AS', 'XS', 'MQ')}
-                    new_tag_update = dict(list(isize_dict.items()) + list(new_tag.items()))
-                    bed_metrics_dict[string].append(new_tag_update)
-                except KeyError:
-                    try:
-                        new_tag = {k: tag_dict[k] for k in ('AS', 'XS')}
-                        new_tag_update = dict(list(isize_dict.items()) + list(new_tag.items()))
-                        bed_metrics_dict[string].append(new_tag_update)
-                    except KeyError:
-                        new_tag = {k: tag_dict[k] for k in ('AS')}
-                        new_tag_update = dict(list(isize_dict.items()) + list(new_tag.items()))
-                        bed_metrics_dict[string].appned(new_tag_update)
-        read_depth_dict[string] = count
+        chrom_dict[chrom].append((int(i[1]), int(i[2]), string))
+    for chrom in chrom_dict:
+        chrom_dict[chrom].sort()
+    return chrom_dict, list(probe_order)
+
+
+def cluster_probes(probes, max_gap=SCAN_GAP):
+    """
+    merge sorted probes that overlap or sit within max_gap
+    of each other so every stretch of the chromosome is
+    fetched and decompressed once
+    """
+    cluster = []
+    cluster_stop = 0
+    for probe in probes:
+        if cluster and probe[0] >= cluster_stop + max_gap:
+            yield cluster, cluster_stop
+            cluster = []
+        if not cluster:
+            cluster_stop = probe[1]
+        cluster.append(probe)
+        cluster_stop = max(cluster_stop, probe[1])
+    if cluster:
+        yield cluster, cluster_stop
+
+
+class FieldStats(object):
+    """
+    running count/sum/sum of squares/min of one read metric
+    plus a value histogram for an exact median
+    """
+    __slots__ = ('count', 'total', 'total_sq', 'minimum', 'hist')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.total_sq = 0
+        self.minimum = None
+        self.hist = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        self.hist[value] = self.hist.get(value, 0) + 1
+
+    def _mean(self):
+        return self.total / self.count
+
+    def _std(self):
+        var = (self.count * self.total_sq - self.total * self.total) / (self.count * self.count)
+        return math.sqrt(max(var, 0))
+
+    def _median(self):
+        low_rank = (self.count - 1) // 2
+        high_rank = self.count // 2
+        cumulative = 0
+        low = None
+        for value in sorted(self.hist):
+            cumulative += self.hist[value]
+            if low is None and cumulative > low_rank:
+                low = value
+            if cumulative > high_rank:
+                return (low + value) / 2
+
+
+class ProbeMetrics(object):
+    """
+    streaming accumulator of the read metrics of one probe,
+    memory does not grow with the number of reads
+    """
+    __slots__ = ('names', 'fields', 'mapq_lt10',
+                 'max_reads', 'seen', 'reservoir', 'seed', 'rng')
+
+    def __init__(self, names, max_reads=None, probe=None):
+        self.names = names
+        self.fields = [FieldStats() for name in names]
+        self.mapq_lt10 = 0
+        self.max_reads = max_reads
+        self.seen = 0
+        self.reservoir = []
+        self.seed = zlib.crc32(probe.encode()) if probe else 0
+        self.rng = None
+
+    def slot(self):
+        """
+        reservoir slot for the next read, -1 when the probe is
+        not sampled and None when the read is dropped
+        """
+        if not self.max_reads:
+            return -1
+        self.seen += 1
+        if len(self.reservoir) < self.max_reads:
+            return len(self.reservoir)
+        if self.rng is None:
+            self.rng = random.Random(self.seed)
+        slot = self.rng.randrange(self.seen)
+        return slot if slot < self.max_reads else None
+
+    def keep(self, metrics, slot):
+        if slot < 0:
+            self.add(metrics)
+        elif slot == len(self.reservoir):
+            self.reservoir.append(metrics)
+        else:
+            self.reservoir[slot] = metrics
+
+    def flush(self):
+        for metrics in self.reservoir:
+            self.add(metrics)
+        self.reservoir = []
+        self.rng = None
+
+    def _count_lt10(self):
+        """
+        MAPQ<10 count scaled back up to all reads when sampled
+        """
+        sampled = self.fields[2].count
+        if self.seen > sampled and sampled:
+            return int(round(self.mapq_lt10 * self.seen / sampled))
+        return self.mapq_lt10
+
+    def add(self, metrics):
+        for field, value in zip(self.fields, metrics):
+            if value == value:
+                field.add(value)
+        if metrics[2] < 10:
+            self.mapq_lt10 += 1
+
+    def _items(self):
+        for name, field in zip(self.names, self.fields):
+            if field.count:
+                yield name, field
+
+
+def metric_fields(tags=DEFAULT_TAGS):
+    return READ_FIELDS + tuple(tags)
+
+
+def read_metrics(read, tags=DEFAULT_TAGS):
+    """
+    isize, proper pair, mapq and the requested aux tags of a
+    read, a tag missing from the read is returned as nan
+    """
+    metrics = [read.template_length,
+               1 if read.is_proper_pair else 0,
+               read.mapping_quality]
+    for tag in tags:
+        metrics.append(read.get_tag(tag) if read.has_tag(tag) else np.nan)
+    return metrics
+
+
+def scan_cluster(samfile, chrom, cluster, cluster_stop,
+                 bed_metrics_dict, read_depth_dict, config=ScanConfig()):
+    """
+    sweep the reads of one probe cluster, assigning each read
+    to every probe it overlaps through an active-interval window
+    """
+    names = metric_fields(config.tags)
+    active = []
+    active_stop = cluster_stop
+    next_probe = 0
+    for read in samfile.fetch(chrom, cluster[0][0], cluster_stop):
+        read_start = read.reference_start
+        read_stop = read.reference_end or read_start + 1
+        while next_probe < len(cluster) and cluster[next_probe][0] < read_stop:
+            active.append(cluster[next_probe])
+            active_stop = min(active_stop, cluster[next_probe][1])
+            next_probe += 1
+        if active_stop <= read_start:
+            # reads come in start order, the sweep is past these probes
+            for p in active:
+                if p[1] <= read_start and p[2] in bed_metrics_dict:
+                    bed_metrics_dict[p[2]].flush()
+            active = [p for p in active if p[1] > read_start]
+            active_stop = min([p[1] for p in active], default=cluster_stop)
+        metrics = None
+        skip = read.flag & config.skip_flags
+        for start, stop, string in active:
+            if start < read_stop and stop > read_start:
+                read_depth_dict[string] += 1
+                probe = bed_metrics_dict.get(string)
+                if probe is None:
+                    # created for skipped reads too, the probe keeps its row
+                    probe = bed_metrics_dict[string] = ProbeMetrics(names,
+                                                                    config.max_reads,
+                                                                    string)
+                if skip:
+                    continue
+                slot = probe.slot()
+                if slot is None:
+                    continue
+                if metrics is None:
+                    metrics = read_metrics(read, config.tags)
+                probe.keep(metrics, slot)
+    for start, stop, string in active:
+        if string in bed_metrics_dict:
+            bed_metrics_dict[string].flush()
+
+
+def list_clusters(chrom_dict):
+    for chrom, probes in chrom_dict.items():
+        for cluster, cluster_stop in cluster_probes(probes):
+            yield chrom, cluster, cluster_stop
+
+
+def shard_probes(bam_file, chrom_dict, n_shards, config=ScanConfig()):
+    """
+    split the probe clusters into contiguous shards with a
+    balanced expected read count, estimated from the cluster
+    span and the mapped read density of its chromosome
+    """
+    samfile = open_alignment_file(bam_file, config.reference)
+    density = {}
+    try:
+        for stat in samfile.get_index_statistics():
+            length = samfile.get_reference_length(stat.contig)
+            density[stat.contig] = stat.mapped / length if length else 0
+    except ValueError:
+        pass
+    samfile.close()
+    clusters = list(list_clusters(chrom_dict))
+    weights = [(stop - cluster[0][0]) * density.get(chrom, 1)
+               for chrom, cluster, stop in clusters]
+    if not sum(weights):
+        weights = [stop - cluster[0][0] for chrom, cluster, stop in clusters]
+    target = sum(weights) / max(n_shards, 1)
+    shards = [[]]
+    load = 0
+    for cluster, weight in zip(clusters, weights):
+        if shards[-1] and load >= target:
+            shards.append([])
+            load = 0
+        shards[-1].append(cluster)
+        load += weight
+    return shards
+
+
+def scan_shard(bam_file, shard, threads=1, config=ScanConfig()):
+    """
+    sweep one shard of probe clusters with its own bam handle
+    """
+    bed_metrics_dict = {}
+    read_depth_dict = defaultdict(int)
+    samfile = open_alignment_file(bam_file, config.reference, threads)
+    for chrom, cluster, cluster_stop in shard:
+        scan_cluster(samfile, chrom, cluster, cluster_stop,
+                     bed_metrics_dict, read_depth_dict, config)
+    samfile.close()
+    return bed_metrics_dict, dict(read_depth_dict)
+
+
+def index_out_bam(bam_file, bed_list, processes=1, threads=1,
+                  config=ScanConfig()):
+    """
+    open the bam once and sweep each chromosome in
+    probe order instead of re-opening it for every probe,
+    with processes > 1 the sweep is sharded across workers
+    """
+    chrom_dict, probe_order = group_probes(bed_list)
+    return scan_probes(bam_file, chrom_dict, probe_order,
+                       processes, threads, config)
+
+
+def scan_probes(bam_file, chrom_dict, probe_order, processes=1, threads=1,
+                config=ScanConfig()):
+    """
+    sweep an already grouped probe set, see group_probes
+    """
+    scan_metrics_dict = {}
+    read_depth_dict = dict.fromkeys(probe_order, 0)
+    if processes > 1:
+        shards = shard_probes(bam_file, chrom_dict,
+                              processes * SHARDS_PER_PROCESS, config)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for shard_metrics, shard_depth in executor.map(scan_shard,
+                                                           repeat(bam_file),
+                                                           shards,
+                                                           repeat(threads),
+                                                           repeat(config)):
+                scan_metrics_dict.update(shard_metrics)
+                read_depth_dict.update(shard_depth)
+    else:
+        shard = list(list_clusters(chrom_dict))
+        scan_metrics_dict, shard_depth = scan_shard(bam_file, shard,
+                                                    threads, config)
+        read_depth_dict.update(shard_depth)
+    bed_metrics_dict = {}
+    for string in probe_order:
+        if string in scan_metrics_dict:
+            bed_metrics_dict[string] = scan_metrics_dict[string]
     return bed_metrics_dict, read_depth_dict
 
 
 def modify_dict(bed_metrics_dict, read_depth_dict):
     new_merged_dict =  {}
     for k, v in bed_metrics_dict.items():
-        new_v = defaultdict(list)
-        for x in v:
-            for p, q in x.items():
-                new_v[p].append(q)
-        less_than10 = len([x for x in new_v['MAPQ'] if x < 10])
-        total_items = len(new_v['MAPQ'])
-        percentage_less_than_10 = (less_than10 / total_items) * 100 if total_items != 0 else 0
+        less_than10 = v.mapq_lt10
+        total_items = v.fields[2].count
+        percentage_less_than_10 = (less_than10 / total_items) * 100 if total_items != 0 else np.nan
         new_pct_lt10 = {'pct_count_mapq_Lt10':percentage_less_than_10}
-        new_cnt_lt10 = {'count_mapq_Lt10':less_than10}
-        new_median_v = {r +"_median": np.median(s)  for r, s in new_v.items()}
-        new_mean_v = {r +"_mean": np.mean(s)  for r, s in new_v.items()}
-        new_std_v = {r + "_std": np.std(s)  for r, s in new_v.items()}
-        new_min_v = {r +"_min": np.min(s)  for r, s in new_v.items()}
+        new_cnt_lt10 = {'count_mapq_Lt10':v._count_lt10()}
+        new_median_v = {r +"_median": s._median()  for r, s in v._items()}
+        new_mean_v = {r +"_mean": s._mean()  for r, s in v._items()}
+        new_std_v = {r + "_std": s._std()  for r, s in v._items()}
+        new_min_v = {r +"_min": s.minimum  for r, s in v._items()}
         dp_dict = {'raw_dp': read_depth_dict[k]  if read_depth_dict[k] else True}
         result_dict = {**new_median_v, **new_mean_v, **new_std_v, **new_min_v, **new_pct_lt10, **new_cnt_lt10,**dp_dict}
         new_merged_dict[k] = result_dict
-    print(new_merged_dict)
     return new_merged_dict
 
 
@@ -145,17 +517,44 @@ def normalize_list(input_list):
 #def calculate_mq_count(
 
 
-def create_dataframe(bed_metrics_dict, 
-                     sample_name, 
-                     out_dir, 
-                     read_dict):
-    df = pd.DataFrame.from_dict((modify_dict(bed_metrics_dict, read_dict)), orient='index')
+def metrics_columns(config=ScanConfig()):
+    """
+    full column order of a metrics table
+    """
+    columns = ['probe']
+    for stat in ('_median', '_mean', '_std', '_min'):
+        columns.extend(field + stat for field in metric_fields(config.tags))
+    columns.extend(['pct_count_mapq_Lt10', 'count_mapq_Lt10', 'raw_dp', 'SAMPLE_NAME'])
+    return columns
+
+
+def build_dataframe(bed_metrics_dict,
+                    sample_name,
+                    read_dict,
+                    config=ScanConfig()):
+    """
+    metrics table in the metrics_columns order, fields
+    without a value in any probe are left empty
+    """
+    rows = modify_dict(bed_metrics_dict, read_dict)
+    # from_dict moves rows with fewer fields to the end, keep the probe order
+    df = pd.DataFrame.from_dict(rows, orient='index').reindex(list(rows))
     df.reset_index(inplace=True)
     df = df.rename(columns = {'index': 'probe'})
     sample =  sample_name.split('.')[0]
     df['SAMPLE_NAME'] = sample
-    filename = out_dir + "/" + sample_name + '.metrics.csv'
-    pd.DataFrame.to_csv(df, filename, index=False)
+    return df.reindex(columns=metrics_columns(config))
+
+
+def create_dataframe(bed_metrics_dict, 
+                     sample_name, 
+                     out_dir, 
+                     read_dict,
+                     table_format='csv',
+                     config=ScanConfig()):
+    df = build_dataframe(bed_metrics_dict, sample_name, read_dict, config)
+    filename = out_dir + "/" + sample_name + '.metrics' + table_suffix(table_format)
+    write_table(df, filename, table_format)
 
 
 
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+"""
+This script keeps a cohort of per sample metrics as
+a feature store, a directory of one parquet partition
+per sample and a manifest, samples are added without
+rewriting the others and reads select samples, probes
+and columns without scanning the whole cohort
+
+python -m bam.feature_store add -s store_dir metrics.csv ... [-n S1,S2] [--replace S1]
+python -m bam.feature_store read -s store_dir -o out.csv [--samples a,b] [--probes probes.txt]
+python -m bam.feature_store list -s store_dir
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import tempfile
+import time
+from urllib.parse import quote
+import pandas as pd
+from pipeline.table_io import add_format_arg, read_table, write_table
+
+MANIFEST = 'manifest.json'
+ROW_GROUP_SIZE = 4096
+
+
+def main():
+    args = parse_args()
+    store = FeatureStore(args.store_dir)
+    if args.command == 'add':
+        names = args.names.split(',') if args.names else [None] * len(args.metrics_files)
+        if len(names) != len(args.metrics_files):
+            raise ValueError("-n needs one sample name per metrics table")
+        replace = args.replace.split(',') if args.replace else False
+        for metrics_file, sample_name in zip(args.metrics_files, names):
+            store.add_table(metrics_file, sample_name, replace)
+    elif args.command == 'read':
+        samples = args.samples.split(',') if args.samples else None
+        probes = read_probes(args.probes) if args.probes else None
+        columns = args.columns.split(',') if args.columns else None
+        df = store.read(samples, probes, columns)
+        write_table(df, args.outname, args.table_format)
+    else:
+        for sample_name, entry in store.manifest['samples'].items():
+            print('\t'.join([sample_name, entry['file'], str(entry['rows'])]))
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_parser = subparsers.add_parser('add', help="add per sample metrics tables")
+    add_parser.add_argument('-s', dest='store_dir',
+                            help="feature store directory",
+                            required=True)
+    add_parser.add_argument('metrics_files', nargs='+',
+                            help="metrics tables written by extract_bam_summary.py")
+    add_parser.add_argument('-n', dest='names',
+                            help="comma separated sample names, one per table, "
+                                 "by default the SAMPLE_NAME column or the file name",
+                            default=None)
+    add_parser.add_argument('--replace', dest='replace',
+                            help="comma separated samples that may overwrite a sample "
+                                 "of the same name added from another table",
+                            default=None)
+    read_parser = subparsers.add_parser('read', help="write a subset of the cohort")
+    read_parser.add_argument('-s', dest='store_dir',
+                             help="feature store directory",
+                             required=True)
+    read_parser.add_argument('-o', dest='outname',
+                             help="output table",
+                             required=True)
+    read_parser.add_argument('--samples', dest='samples',
+                             help="comma separated samples, all when not given",
+                             default=None)
+    read_parser.add_argument('--probes', dest='probes',
+                             help="file of probe names, one per line, all when not given",
+                             default=None)
+    read_parser.add_argument('--columns', dest='columns',
+                             help="comma separated columns, all when not given",
+                             default=None)
+    add_format_arg(read_parser)
+    list_parser = subparsers.add_parser('list', help="list the samples in the store")
+    list_parser.add_argument('-s', dest='store_dir',
+                             help="feature store directory",
+                             required=True)
+    args = parser.parse_args()
+    return args
+
+
+def read_probes(filename):
+    with open(filename) as fh:
+        return [line.strip() for line in fh if line.strip()]
+
+
+class FeatureStore(object):
+    """
+    manifest.json maps every sample to its partition,
+    row count and columns, partitions are sorted by
+    probe so probe filters skip whole row groups
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(os.path.join(store_dir, 'samples'), exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        manifest_file = os.path.join(self.store_dir, MANIFEST)
+        if not os.path.isfile(manifest_file):
+            return {'columns': None, 'samples': {}}
+        with open(manifest_file) as fh:
+            return json.load(fh)
+
+    @property
+    def samples(self):
+        return list(self.manifest['samples'])
+
+    def _lock(self):
+        fh = open(os.path.join(self.store_dir, '.lock'), 'w')
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        return fh
+
+    def add_sample(self, df, sample_name, replace=False, source=None):
+        """
+        write one sample partition and record it in the
+        manifest, concurrent writers take turns on a lock,
+        columns are written in the order of the store, a
+        sample already added from another source is only
+        overwritten with replace
+        """
+        df = df.sort_values('probe', kind='stable').reset_index(drop=True)
+        columns = self._load_manifest()['columns']
+        if columns is not None and set(df.columns) == set(columns):
+            df = df[columns]
+        partition = os.path.join('samples', 'sample=' + quote(sample_name, safe='') + '.parquet')
+        fd, tmp_name = tempfile.mkstemp(dir=os.path.join(self.store_dir, 'samples'),
+                                        suffix='.parquet')
+        os.close(fd)
+        write_table(df, tmp_name, 'parquet', row_group_size=ROW_GROUP_SIZE)
+        lock = self._lock()
+        try:
+            self.manifest = self._load_manifest()
+            columns = self.manifest['columns']
+            if columns is None:
+                columns = list(df.columns)
+            elif set(df.columns) != set(columns):
+                os.unlink(tmp_name)
+                raise ValueError("columns of sample {0} do not match the store".format(sample_name))
+            elif list(df.columns) != columns:
+                # the first sample of the store landed while this one was written
+                df = df[columns]
+                write_table(df, tmp_name, 'parquet', row_group_size=ROW_GROUP_SIZE)
+            known = self.manifest['samples'].get(sample_name)
+            if known is not None and not replace and (source is None
+                                                      or known.get('source') != source):
+                os.unlink(tmp_name)
+                raise ValueError("sample {0} is already in the store from {1}".format(
+                    sample_name, known.get('source', known['file'])))
+            os.replace(tmp_name, os.path.join(self.store_dir, partition))
+            self.manifest['columns'] = columns
+            self.manifest['samples'][sample_name] = {'file': partition,
+                                                     'rows': len(df),
+                                                     'source': source,
+                                                     'added': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            _write_json(os.path.join(self.store_dir, MANIFEST), self.manifest)
+        finally:
+            lock.close()
+
+    def add_table(self, metrics_file, sample_name=None, replace=False):
+        """
+        add a metrics table, named by its SAMPLE_NAME when
+        no name is given, replace is a bool or the samples
+        that may be replaced, re-adding the same file
+        updates its sample
+        """
+        df = read_table(metrics_file)
+        if sample_name is None:
+            names = df['SAMPLE_NAME'].unique() if 'SAMPLE_NAME' in df.columns else []
+            sample_name = str(names[0]) if len(names) == 1 else os.path.basename(metrics_file)
+        if not isinstance(replace, bool):
+            replace = sample_name in replace
+        self.add_sample(df, sample_name, replace, os.path.abspath(metrics_file))
+        return sample_name
+
+    def iter_samples(self, samples=None, probes=None, columns=None):
+        """
+        sample name and frame of the selected samples, only
+        row groups that can hold the probes are read
+        """
+        if samples is None:
+            samples = self.samples
+        missing = [s for s in samples if s not in self.manifest['samples']]
+        if missing:
+            raise ValueError("samples not in the store {0}".format(', '.join(missing)))
+        filters = [('probe', 'in', list(probes))] if probes is not None else None
+        if columns is not None and probes is not None and 'probe' not in columns:
+            columns = ['probe'] + list(columns)
+        for sample_name in samples:
+            partition = os.path.join(self.store_dir, self.manifest['samples'][sample_name]['file'])
+            yield sample_name, read_table(partition, columns=columns, filters=filters)
+
+    def read(self, samples=None, probes=None, columns=None):
+        frames = [df for _, df in self.iter_samples(samples, probes, columns)]
+        if not frames:
+            return pd.DataFrame(columns=columns or self.manifest['columns'] or [])
+        return pd.concat(frames, ignore_index=True)
+
+
+def _write_json(filename, value):
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(filename))
+    with os.fdopen(fd, 'w') as fout:
+        json.dump(value, fout, indent=1)
+    os.replace(tmp_name, filename)
+
+
+if __name__ == "__main__":
+    main()
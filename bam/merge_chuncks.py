@@ -1,16 +1,34 @@
 #!/usr/bin/env python
 
+"""
+This script merges the metrics chunks of a
+directory into one table, chunks are appended
+one at a time in file name order so memory
+stays at one chunk whatever the cohort size
+"""
 
 import pysam
 import argparse
 import collections
 import pandas as pd
 import glob
+import os
 import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import sys
+if not __package__:
+    # run as a file from a checkout, put the repo root on the path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.table_io import (add_format_arg, read_table, table_format_of,
+                               TableWriter, SUFFIXES)
+
+COPY_BUFFER = 1 << 24
+
 
 def main():
     args = parse_args()
-    run(args.input_dir, args.out_dir)
+    run(args.input_dir, args.out_dir, args.table_format, args.threads)
 
 
 def parse_args():
@@ -21,29 +39,117 @@ def parse_args():
     parser.add_argument('-i', dest='input_dir',
                        help='dir to chunks',
                        required=True)
-    parser.add_argument('-o', dest='out_dir', 
-                        help="out dir", 
+    parser.add_argument('-o', dest='out_dir',
+                        help="out dir",
                         required=True)
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        help="number of chunks read ahead in parallel",
+                        default=1)
+    add_format_arg(parser)
     args = parser.parse_args()
     return args
 
 
-def run(input_dir, out_dir):
-    outname='outfile.txt'
-    merge_files = merge_chunk_csv(input_dir, out_dir, outname)
-
+def run(input_dir, out_dir, table_format='csv', threads=1):
+    if table_format == 'csv':
+        outname='outfile.txt'
+    else:
+        outname='outfile' + SUFFIXES[table_format]
+    merge_files = merge_chunk_csv(input_dir, out_dir, outname, table_format,
+                                  threads)
 
 
-def merge_chunk_csv(input_dir, out_dir, outname):
+def list_chunks(input_dir):
     all_files = glob.glob(input_dir + "/*.csv")
-    li = []
+    for suffix in SUFFIXES.values():
+        all_files.extend(glob.glob(input_dir + "/*" + suffix))
+    if not all_files:
+        raise ValueError("no chunks to merge in {0}".format(input_dir))
+    return sorted(all_files, key=os.path.basename)
 
-    for filename in all_files:
-        df = pd.read_csv(filename, index_col=None, header=0)
-        li.append(df)
-    frame = pd.concat(li, axis=0, ignore_index=True)
+
+def merge_chunk_csv(input_dir, out_dir, outname, table_format='csv', threads=1):
+    all_files = list_chunks(input_dir)
     out_name = out_dir + "/" + outname
-    pd.DataFrame.to_csv(frame, out_name, index=False)
+    merge_chunks(all_files, out_name, table_format, threads)
+
+
+def merge_chunks(all_files, out_name, table_format='csv', threads=1):
+    """
+    append every chunk to the merged table, csv chunks
+    merged to csv are copied as text after the header
+    """
+    if table_format == 'csv' and all(table_format_of(f) == 'csv' for f in all_files):
+        copy_csv_chunks(all_files, out_name)
+    else:
+        with TableWriter(out_name, table_format) as writer:
+            for filename, df in read_chunks(all_files, threads):
+                writer.write(df)
+
+
+def align_columns(df, columns, filename, first_file):
+    """
+    chunk in the column order of the first chunk, the
+    writers order columns by the fields present in the data
+    """
+    if set(df.columns) != set(columns):
+        raise ValueError("columns of {0} do not match {1}".format(filename, first_file))
+    return df[columns]
+
+
+def copy_csv_chunks(all_files, out_name):
+    """
+    text copy of chunks with the header of the first one,
+    a chunk with its columns in another order is
+    rewritten in that order
+    """
+    header = None
+    with open(out_name, 'w') as fout:
+        for filename in all_files:
+            with open(filename) as fh:
+                chunk_header = fh.readline()
+                if header is None:
+                    header = chunk_header
+                    columns = header.rstrip('\r\n').split(',')
+                    fout.write(header)
+                elif chunk_header.rstrip('\r\n') != header.rstrip('\r\n'):
+                    df = align_columns(pd.read_csv(filename), columns,
+                                       filename, all_files[0])
+                    df.to_csv(fout, header=False, index=False)
+                    continue
+                last = '\n'
+                for block in iter(lambda: fh.read(COPY_BUFFER), ''):
+                    fout.write(block)
+                    last = block[-1]
+                if last != '\n':
+                    fout.write('\n')
+
+
+def read_chunks(all_files, threads=1):
+    """
+    chunks in file order with at most threads of them
+    read ahead, in the column order of the first chunk,
+    raises on a change of the column set
+    """
+    columns = None
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        files = iter(all_files)
+        for filename in files:
+            pending.append((filename, executor.submit(read_table, filename)))
+            if len(pending) >= threads:
+                break
+        while pending:
+            filename, future = pending.popleft()
+            df = future.result()
+            if columns is None:
+                columns = list(df.columns)
+            elif list(df.columns) != columns:
+                df = align_columns(df, columns, filename, all_files[0])
+            for next_file in files:
+                pending.append((next_file, executor.submit(read_table, next_file)))
+                break
+            yield filename, df
 
 
 if __name__ == "__main__":
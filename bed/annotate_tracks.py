@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+
+"""
+This script annotates a given bed file with
+overlap and reciprocal overlap of every track
+in a manifest and writes a single wide table
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+import pandas as pd
+import numpy as np
+import os
+import random
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from bed.overlap import track_overlap
+from bed.bed_reader import read_bed_frame
+from bed.track_cache import track_index
+from bed.probe_store import ProbeStore, DEFAULT_BUILD
+from pipeline.table_io import add_format_arg, write_table
+
+_querry_df = None
+_track_cache = None
+_probe_store = None
+
+
+def main():
+    args = parse_args()
+    run(args.target_bed,
+        args.manifest,
+        args.outname,
+        args.processes,
+        args.track_cache,
+        args.table_format,
+        args.probe_store,
+        args.build)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-i',dest='target_bed',
+                        help="bed file to annotate",
+                        required=True)
+    parser.add_argument('-m',dest='manifest',
+                        help="tab separated manifest of annotation name and annotation bed track",
+                        required=True)
+    parser.add_argument('-o',dest='outname',
+                        help="name of the wide annotation table",
+                        required=True)
+    parser.add_argument('-p', '--processes', dest='processes', type=int,
+                        help="number of tracks annotated in parallel",
+                        default=1)
+    parser.add_argument('-c',dest='track_cache',
+                        help="compiled track cache directory, see track_cache.py",
+                        default=None)
+    parser.add_argument('-d',dest='probe_store',
+                        help="sqlite probe annotation store, only probes missing from it are computed",
+                        default=None)
+    parser.add_argument('--build',dest='build',
+                        help="genome build of the probes and tracks in the probe store",
+                        default=DEFAULT_BUILD)
+    add_format_arg(parser)
+    args = parser.parse_args()
+    return args
+
+
+def run(target_bed,
+        manifest,
+        outname,
+        processes=1,
+        track_cache=None,
+        table_format='csv',
+        probe_store=None,
+        build=DEFAULT_BUILD):
+    assert os.path.isfile(target_bed)
+    tracks = read_manifest(manifest)
+    for anno_name, anno_bed in tracks:
+        assert os.path.isfile(anno_bed)
+    random_int = random.randint(0, 99999)
+    logger = configure_logger(random_int)
+    querry_df = read_bed_frame(target_bed, "querry")
+    wide_df = annotate_tracks(querry_df,
+                              tracks,
+                              logger,
+                              processes,
+                              track_cache,
+                              probe_store,
+                              build)
+    write_table(wide_df, outname, table_format, sep='\t')
+
+
+def configure_logger(value):
+    """
+    setting up logging
+    """
+    logger = logging.getLogger('Annotate_Tracks')
+    logger.setLevel(logging.DEBUG)
+    handler = logging.FileHandler(time.strftime("Annotate_Tracks" + str(value) + "-%Y%m%d.log"))
+    handler.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s'\t'%(name)s'\t'%(levelname)s'\t'%(message)s")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    return logger
+
+
+def read_manifest(manifest):
+    """
+    annotation name and bed track per line
+    """
+    tracks = []
+    with open(manifest) as fh:
+        for raw_line in fh:
+            value = raw_line.strip().split('\t')
+            if not value[0] or value[0].startswith('#'):
+                continue
+            tracks.append((value[0].strip(), value[1].strip()))
+    return tracks
+
+
+def _init_worker(querry_df, track_cache, probe_store=None, build=DEFAULT_BUILD):
+    global _querry_df, _track_cache, _probe_store
+    _querry_df = querry_df
+    _track_cache = track_cache
+    _probe_store = ProbeStore(probe_store, build) if probe_store else None
+
+
+def annotate_track(track):
+    anno_name, anno_bed = track
+    logger = logging.getLogger('Annotate_Tracks')
+    if _probe_store:
+        out_df = _probe_store.track_overlap(_querry_df, anno_bed, anno_name,
+                                            lambda: track_index(anno_bed, anno_name, _track_cache))
+    else:
+        out_df = track_overlap(_querry_df,
+                               track_index(anno_bed, anno_name, _track_cache),
+                               anno_name)
+    if not len(out_df):
+        logger.debug("no overlap with annotation track {0}".format(anno_name))
+    return anno_name, out_df
+
+
+def annotate_tracks(querry_df,
+                    tracks,
+                    logger,
+                    processes=1,
+                    track_cache=None,
+                    probe_store=None,
+                    build=DEFAULT_BUILD):
+    """
+    one row per querry interval with the .PO and .RPO
+    of every track, 0 where the track does not overlap
+    """
+    keys = querry_df[['chrom', 'start', 'end']].drop_duplicates().reset_index(drop=True)
+    key_index = pd.MultiIndex.from_frame(keys)
+    columns = {}
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=_init_worker,
+                             initargs=(querry_df, track_cache,
+                                       probe_store, build)) as executor:
+        for anno_name, out_df in executor.map(annotate_track, tracks):
+            logger.info("annotated track {0}".format(anno_name))
+            rows = key_index.get_indexer(pd.MultiIndex.from_frame(out_df[['chrom', 'start', 'end']]))
+            for col in (anno_name + '.PO', anno_name + '.RPO'):
+                values = np.zeros(len(keys))
+                values[rows] = out_df[col].values
+                columns[col] = values
+    return pd.concat([keys, pd.DataFrame(columns)], axis=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""
+Shared bed reader for the bed and bam scripts,
+parses chrom, start and end of a plain or gzip
+bed file in chunks straight into arrays
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import gzip
+import pandas as pd
+
+GZIP_MAGIC = b'\x1f\x8b'
+CHUNK_SIZE = 1000000
+BED_COLUMNS = ['chrom', 'start', 'end']
+
+
+def is_gzip(bed_file):
+    """
+    gzip and bgzip files start with the gzip magic bytes
+    """
+    with open(bed_file, 'rb') as fh:
+        return fh.read(2) == GZIP_MAGIC
+
+
+def open_bed(bed_file):
+    if hasattr(bed_file, 'read'):
+        return bed_file
+    if is_gzip(bed_file):
+        return gzip.open(bed_file, 'rt')
+    return open(bed_file, 'r')
+
+
+def add_chr_prefix(chrom):
+    chrom = chrom.str.strip()
+    missing = ~chrom.str.startswith('chr')
+    if missing.any():
+        chrom = chrom.where(~missing, 'chr' + chrom)
+    return chrom
+
+
+def iter_bed_chunks(bed_file, chunksize=CHUNK_SIZE, add_chr=True):
+    """
+    chrom, start, end dataframes of at most chunksize
+    lines, chrom gets a chr prefix when add_chr is set
+    """
+    fh = open_bed(bed_file)
+    try:
+        try:
+            reader = pd.read_csv(fh, sep='\t', header=None,
+                                 usecols=[0, 1, 2], names=BED_COLUMNS,
+                                 dtype={'chrom': str}, comment='#',
+                                 skipinitialspace=True, chunksize=chunksize)
+        except pd.errors.EmptyDataError:
+            return
+        for chunk in reader:
+            if not (pd.api.types.is_integer_dtype(chunk['start'])
+                    and pd.api.types.is_integer_dtype(chunk['end'])):
+                raise ValueError("bed file is not in valid bed format {0}".format(bed_file))
+            chunk['chrom'] = add_chr_prefix(chunk['chrom']) if add_chr else chunk['chrom'].str.strip()
+            yield chunk
+    finally:
+        if fh is not bed_file:
+            fh.close()
+
+
+def read_bed_frame(bed_file, anno=None, add_chr=True):
+    """
+    whole bed as chrom, start, end, anno, length
+    """
+    chunks = list(iter_bed_chunks(bed_file, add_chr=add_chr))
+    if chunks:
+        df = pd.concat(chunks, ignore_index=True)
+    else:
+        df = pd.DataFrame({'chrom': pd.Series([], dtype=str),
+                           'start': pd.Series([], dtype='int64'),
+                           'end': pd.Series([], dtype='int64')})
+    df['anno'] = anno
+    df['length'] = df['end'] - df['start']
+    return df
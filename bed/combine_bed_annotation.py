@@ -13,13 +13,25 @@ import collections
 import pandas as pd
 import glob
 import numpy as np
-from functools import reduce
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+if not __package__:
+    # run as a file from a checkout, put the repo root on the path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bed.bed_reader import add_chr_prefix
+from pipeline.table_io import add_format_arg, read_table, write_table, SUFFIXES
+
+KEY_COLUMNS = ['chrom', 'start', 'end']
+QUERRY_COLUMNS = ['chrom', 'start', 'end', 'gene', 'number', 'strand']
 
 def main():
     args = parse_args()
     run(args.input_dir,
         args.querry_bed,
-        args.outname)
+        args.outname,
+        args.threads,
+        args.table_format)
 
 
 def parse_args():
@@ -36,34 +48,85 @@ def parse_args():
     parser.add_argument('-o', dest='outname', 
                         help="name of the output file name", 
                         required=True)    
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        help="number of annotation files read concurrently",
+                        default=1)
+    add_format_arg(parser)
     args = parser.parse_args()
     return args
 
 
-def run(input_dir,querry_bed, outname):
+def run(input_dir,querry_bed, outname, threads=1, table_format='csv'):
     merge_files = merge_chunk_tsv(input_dir,
                                   querry_bed,
-                                  outname)
-
-    
-def merge_chunk_tsv(input_dir, querry_bed, outname):
-    all_files = glob.glob(input_dir + "/*.tsv")
-    df = pd.read_csv(querry_bed, sep='\t', names = ['chrom', 'start', 'end',
-                                                    'gene', 'number', 'strand'])
-    df['chrom'] = df['chrom'].astype(str)
-    df['start'] =  df['start'].astype(str)
-    df['end'] = df['end'].astype(str)
-    list_df = [df]
-    for filename in all_files:
-        new_df = pd.read_csv(filename, index_col=None, sep='\t')
-        new_df['chrom'] = new_df['chrom'].astype(str)
-        new_df['start'] = new_df['start'].astype(str)
-        new_df['end'] = new_df['end'].astype(str)
-        list_df.append(new_df)
-    df_merged = reduce(lambda  left,right: pd.merge(left,right,on=['chrom', 'start', 'end'],
-                                                    how='outer'), list_df)
+                                  outname,
+                                  threads,
+                                  table_format)
+
+
+def read_track(filename):
+    return read_table(filename, sep='\t', index_col=None,
+                      dtype={'chrom': str})
+
+
+def encode_keys(df, chrom_codes):
+    """
+    integer (chrom code, start, end) keys of a frame
+    """
+    codes = pd.Categorical(df['chrom'].astype(str),
+                           categories=chrom_codes).codes.astype(np.int64)
+    return pd.MultiIndex.from_arrays([codes,
+                                      df['start'].values.astype(np.int64),
+                                      df['end'].values.astype(np.int64)])
+
+
+def merge_chunk_tsv(input_dir, querry_bed, outname, threads=1, table_format='csv'):
+    suffixes = ['.tsv'] + list(SUFFIXES.values())
+    all_files = sorted(f for suffix in suffixes
+                       for f in glob.glob(input_dir + "/*" + suffix))
+    combine_tracks(all_files, querry_bed, outname, threads, table_format)
+
+
+def combine_tracks(all_files, querry_bed, outname, threads=1, table_format='csv'):
+    """
+    align the columns of every annotation file to the
+    querry probes in one pass into a float32 matrix,
+    annotation rows missing from the querry bed are
+    appended at the end as an outer join would
+    """
+    df = pd.read_csv(querry_bed, sep='\t', names = QUERRY_COLUMNS,
+                     dtype={'chrom': str})
+    # the track tables carry the chr prefixed chroms of read_bed_frame
+    df['chrom'] = add_chr_prefix(df['chrom'])
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        tracks = list(executor.map(read_track, all_files))
+    chrom_codes = pd.unique(pd.concat([df['chrom']] + [t['chrom'] for t in tracks]))
+    querry_keys = encode_keys(df, chrom_codes)
+    key_index = querry_keys.unique()
+    track_keys = [encode_keys(t, chrom_codes) for t in tracks]
+    extra_keys = [k[key_index.get_indexer(k) < 0] for k in track_keys]
+    extra_index = key_index[:0].append(extra_keys).unique()
+    key_index = key_index.append(extra_index)
+    value_columns = [[c for c in t.columns if c not in KEY_COLUMNS] for t in tracks]
+    matrix = np.zeros((len(key_index), sum(len(c) for c in value_columns)),
+                      dtype=np.float32)
+    offset = 0
+    for track, keys, columns in zip(tracks, track_keys, value_columns):
+        rows = key_index.get_indexer(keys)
+        matrix[rows, offset:offset + len(columns)] = track[columns].fillna(0).values
+        offset += len(columns)
+    names = [c for columns in value_columns for c in columns]
+    n_querry_keys = len(key_index) - len(extra_index)
+    rows = np.concatenate([key_index.get_indexer(querry_keys),
+                           np.arange(n_querry_keys, len(key_index))])
+    extra_df = pd.DataFrame(0, index=range(len(extra_index)), columns=QUERRY_COLUMNS)
+    extra_df['chrom'] = chrom_codes[extra_index.get_level_values(0)]
+    extra_df['start'] = extra_index.get_level_values(1)
+    extra_df['end'] = extra_index.get_level_values(2)
+    df_merged = pd.concat([df, extra_df], ignore_index=True)
+    df_merged = pd.concat([df_merged, pd.DataFrame(matrix[rows], columns=names)], axis=1)
     df_merged.fillna(0, inplace=True)
-    pd.DataFrame.to_csv(df_merged, outname, sep='\t',index=False)
+    write_table(df_merged, outname, table_format, sep='\t')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""
+In memory overlap of a querry bed with an
+annotation track, gives the same pairs as
+bedtools intersect -wo without temp files
+or a subprocess
+"""
+
+import numpy as np
+import pandas as pd
+
+LONG_QUANTILE = 0.99
+MIN_SPLIT = 64
+
+
+def long_split(starts, ends):
+    """
+    length cut at LONG_QUANTILE and the positions and own
+    index of the intervals longer than it, None when all
+    intervals are within the cut
+    """
+    if len(starts) <= MIN_SPLIT:
+        return None
+    lengths = np.subtract(ends, starts)
+    cut = int(np.quantile(lengths, LONG_QUANTILE))
+    long_pos = np.flatnonzero(lengths > cut)
+    if not len(long_pos):
+        return None
+    long_starts = np.asarray(starts[long_pos])
+    long_ends = np.asarray(ends[long_pos])
+    long_track = (long_starts, long_ends, np.maximum.accumulate(long_ends))
+    return cut, long_pos, long_track, long_split(long_starts, long_ends)
+
+
+def candidate_pairs(track, split, starts, ends):
+    """
+    query and annotation positions of every annotation
+    starting before a query ends and reaching past its
+    start, the running maximum alone makes one very long
+    interval a candidate of every later query so the
+    intervals longer than the cut are searched on their own
+    """
+    a_starts, a_ends, a_max_ends = track
+    hi = np.searchsorted(a_starts, ends, side='left')
+    lo = np.searchsorted(a_max_ends, starts, side='right')
+    if split is not None:
+        cut, long_pos, long_track, long_track_split = split
+        lo = np.maximum(lo, np.searchsorted(a_starts, starts - cut, side='right'))
+    counts = np.maximum(hi - lo, 0)
+    total = counts.sum()
+    q_idx = np.repeat(np.arange(len(starts)), counts)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    a_idx = np.repeat(lo, counts) + (np.arange(total) - first)
+    if split is not None:
+        long_q, long_a = candidate_pairs(long_track, long_track_split, starts, ends)
+        long_a = long_pos[long_a]
+        # long intervals from lo on are already in the range
+        keep = long_a < lo[long_q]
+        if keep.any():
+            q_idx = np.concatenate([q_idx, long_q[keep]])
+            a_idx = np.concatenate([a_idx, long_a[keep]])
+            order = np.lexsort((a_idx, q_idx))
+            q_idx, a_idx = q_idx[order], a_idx[order]
+    return q_idx, a_idx
+
+
+class IntervalIndex(object):
+    """
+    start sorted intervals per chromosome with the
+    running maximum of their ends, so the intervals
+    overlapping a query are one searchsorted range
+    """
+
+    def __init__(self, chroms=(), starts=(), ends=()):
+        self.tracks = {}
+        self.splits = {}
+        chroms = np.asarray(chroms)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        for chrom, rows in pd.Series(chroms).groupby(chroms).indices.items():
+            order = rows[np.argsort(starts[rows], kind='stable')]
+            self.add_track(chrom, starts[order], ends[order])
+
+    def add_track(self, chrom, starts, ends, max_ends=None):
+        if max_ends is None:
+            max_ends = np.maximum.accumulate(ends) if len(ends) else ends
+        self.tracks[chrom] = (starts, ends, max_ends)
+        self.splits.pop(chrom, None)
+
+    def split(self, chrom):
+        """
+        long_split of a chromosome, built on its first query
+        so loading a memory mapped track stays cheap
+        """
+        if chrom not in self.splits:
+            starts, ends, max_ends = self.tracks[chrom]
+            self.splits[chrom] = long_split(starts, ends)
+        return self.splits[chrom]
+
+    def query(self, chrom, starts, ends):
+        """
+        query position and annotation start, end and
+        overlap in bp of every pair overlapping by >= 1bp
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        track = self.tracks.get(chrom)
+        if track is None or not len(starts):
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, empty
+        a_starts, a_ends, a_max_ends = track
+        if a_starts.dtype == np.int32 and ends.max() <= np.iinfo(np.int32).max:
+            # keep searchsorted from upcasting a memory mapped track
+            starts = starts.astype(np.int32)
+            ends = ends.astype(np.int32)
+        q_idx, a_idx = candidate_pairs(track, self.split(chrom), starts, ends)
+        pair_start = a_starts[a_idx]
+        pair_end = a_ends[a_idx]
+        overlap = (np.minimum(ends[q_idx], pair_end)
+                   - np.maximum(starts[q_idx], pair_start))
+        keep = overlap > 0
+        return q_idx[keep], pair_start[keep], pair_end[keep], overlap[keep]
+
+
+def overlap_frame(querry_df, index):
+    """
+    querry chrom, start, end, length with the annotation
+    length and overlap of every overlapping pair
+    """
+    frames = []
+    chroms = querry_df['chrom'].values
+    for chrom, rows in pd.Series(chroms).groupby(chroms).indices.items():
+        sub = querry_df.iloc[rows]
+        q_idx, a_start, a_end, overlap = index.query(chrom,
+                                                     sub['start'].values,
+                                                     sub['end'].values)
+        if not len(q_idx):
+            continue
+        pairs = sub.iloc[q_idx][['chrom', 'start', 'end', 'length']].reset_index(drop=True)
+        pairs['anno_length'] = a_end - a_start
+        pairs['overlap'] = overlap
+        frames.append(pairs)
+    if not frames:
+        return pd.DataFrame(columns=['chrom', 'start', 'end', 'length',
+                                     'anno_length', 'overlap'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def track_overlap(querry_df, index, anno_name):
+    """
+    mean <anno_name>.PO and .RPO of every querry
+    interval overlapping the track, rounded to 3
+    """
+    b = overlap_frame(querry_df, index)
+    req_cols = ['chrom',
+                'start',
+                'end',
+                anno_name +'.PO',
+                anno_name + '.RPO']
+    if not len(b):
+        return pd.DataFrame(columns=req_cols)
+    b[anno_name +'.PO'] = b['overlap']/b['length']
+    b[anno_name + '.RPO'] = b['overlap']/b['anno_length']
+    out_df = b[req_cols]
+    out_df  = out_df.groupby(['chrom', 'start', 'end'], as_index=False).mean()
+    out_df = out_df.drop_duplicates()
+    out_df[anno_name +'.PO'] = round(out_df[anno_name +'.PO'],3)
+    out_df[anno_name +'.RPO'] = round(out_df[anno_name +'.RPO'],3)
+    return out_df
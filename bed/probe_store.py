@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+Persistent store of the per probe .PO and .RPO of
+every annotation track, keyed by genome build, track
+version (sha256 of the track file) and probe chrom,
+start and end, so annotation only computes probes
+the store has not seen with that track
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import hashlib
+import os
+import sqlite3
+import pandas as pd
+from bed.overlap import track_overlap
+
+KEY_COLUMNS = ['chrom', 'start', 'end']
+DEFAULT_BUILD = 'GRCh37'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    sha256 TEXT
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    track_id INTEGER PRIMARY KEY,
+    build TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    UNIQUE (build, sha256)
+);
+CREATE TABLE IF NOT EXISTS probe_annotation (
+    track_id INTEGER NOT NULL,
+    chrom TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    po REAL,
+    rpo REAL,
+    PRIMARY KEY (track_id, chrom, start, end)
+) WITHOUT ROWID;
+"""
+
+
+class ProbeStore(object):
+    """
+    sqlite probe annotation store, po and rpo are NULL
+    for probes computed without overlap with the track
+    """
+
+    def __init__(self, db_file, build=DEFAULT_BUILD):
+        self.build = build
+        self.conn = sqlite3.connect(db_file, timeout=600)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.conn.execute('CREATE TEMP TABLE querry (chrom TEXT, start INTEGER, end INTEGER)')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def file_digest(self, bed_file):
+        """
+        sha256 of a track, remembered against its size and
+        mtime so an unchanged file is not re-hashed
+        """
+        stat = os.stat(bed_file)
+        source = os.path.abspath(bed_file)
+        known = self.conn.execute('SELECT size, mtime_ns, sha256 FROM sources WHERE path = ?',
+                                  (source,)).fetchone()
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        sha = hashlib.sha256()
+        with open(bed_file, 'rb') as fh:
+            for block in iter(lambda: fh.read(1 << 20), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                              (source, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def track_id(self, bed_file):
+        digest = self.file_digest(bed_file)
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO tracks (build, sha256) VALUES (?, ?)',
+                              (self.build, digest))
+        return self.conn.execute('SELECT track_id FROM tracks WHERE build = ? AND sha256 = ?',
+                                 (self.build, digest)).fetchone()[0]
+
+    def lookup(self, track_id, keys):
+        """
+        stored chrom, start, end, po, rpo of the given keys
+        """
+        with self.conn:
+            self.conn.execute('DELETE FROM querry')
+            self.conn.executemany('INSERT INTO querry VALUES (?, ?, ?)',
+                                  _key_rows(keys))
+        return pd.read_sql_query('SELECT p.chrom, p.start, p.end, p.po, p.rpo '
+                                 'FROM querry q JOIN probe_annotation p '
+                                 'ON p.track_id = ? AND p.chrom = q.chrom '
+                                 'AND p.start = q.start AND p.end = q.end',
+                                 self.conn, params=(track_id,))
+
+    def insert(self, track_id, keys, out_df, anno_name):
+        """
+        po and rpo of computed keys, NULL where out_df
+        has no row for the key
+        """
+        rows = keys[KEY_COLUMNS]
+        if len(out_df):
+            rows = rows.merge(out_df, on=KEY_COLUMNS, how='left')
+        else:
+            rows = rows.assign(**{anno_name + '.PO': None, anno_name + '.RPO': None})
+        rows = rows.astype(object).where(rows.notna(), None)
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO probe_annotation VALUES (?, ?, ?, ?, ?, ?)',
+                                  ((track_id, chrom, int(start), int(end), po, rpo)
+                                   for chrom, start, end, po, rpo in zip(rows['chrom'],
+                                                                         rows['start'],
+                                                                         rows['end'],
+                                                                         rows[anno_name + '.PO'],
+                                                                         rows[anno_name + '.RPO'])))
+
+    def track_overlap(self, querry_df, anno_bed, anno_name, load_index):
+        """
+        overlap.track_overlap output for the querry, only
+        keys missing from the store are computed and the
+        track index is only loaded when one is
+        """
+        track_id = self.track_id(anno_bed)
+        keys = querry_df[KEY_COLUMNS].drop_duplicates()
+        stored = self.lookup(track_id, keys)
+        missing = keys.merge(stored[KEY_COLUMNS], on=KEY_COLUMNS,
+                             how='left', indicator=True)
+        missing = missing.loc[missing['_merge'] == 'left_only', KEY_COLUMNS]
+        stored = stored.dropna(subset=['po', 'rpo'], how='all')
+        stored = stored.rename(columns={'po': anno_name + '.PO',
+                                        'rpo': anno_name + '.RPO'})
+        if not len(missing):
+            return stored.sort_values(KEY_COLUMNS).reset_index(drop=True)
+        sub_df = querry_df.merge(missing, on=KEY_COLUMNS)
+        out_df = track_overlap(sub_df, load_index(), anno_name)
+        self.insert(track_id, missing, out_df, anno_name)
+        out_df = pd.concat([stored, out_df], ignore_index=True)
+        return out_df.sort_values(KEY_COLUMNS).reset_index(drop=True)
+
+
+def _key_rows(keys):
+    return zip(keys['chrom'].astype(str),
+               keys['start'].astype(int).tolist(),
+               keys['end'].astype(int).tolist())
@@ -10,25 +10,30 @@ __github__ = "ADO repo"
 """
 
 import argparse
-import pybedtools
-import csv
-import collections
-import pandas as pd
 import os
-import gzip
-import tempfile
-import zlib
 import random
 import logging
 import time
-import datetime
+import sys
+if not __package__:
+    # run as a file from a checkout, put the repo root on the path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bed.overlap import track_overlap
+from bed.track_cache import track_index
+from bed.probe_store import ProbeStore, DEFAULT_BUILD
+from bed.bed_reader import read_bed_frame
+from pipeline.table_io import add_format_arg, table_suffix, write_table
 
 def main():
     args = parse_args()
     run(args.target_bed,
         args.anno_bed,
         args.anno_name,
-        args.outdir)
+        args.outdir,
+        args.track_cache,
+        args.table_format,
+        args.probe_store,
+        args.build)
 
     
 def parse_args():
@@ -48,6 +53,16 @@ def parse_args():
     parser.add_argument('-o',dest='outdir',
                         help="name of the annnotation to use",
                         required=True)
+    parser.add_argument('-c',dest='track_cache',
+                        help="compiled track cache directory, see track_cache.py",
+                        default=None)
+    parser.add_argument('-d',dest='probe_store',
+                        help="sqlite probe annotation store, only probes missing from it are computed",
+                        default=None)
+    parser.add_argument('--build',dest='build',
+                        help="genome build of the probes and tracks in the probe store",
+                        default=DEFAULT_BUILD)
+    add_format_arg(parser)
     args = parser.parse_args()
     return args
 
@@ -55,28 +70,33 @@ def parse_args():
 def run(target_bed,
         anno_bed,
         anno_name,
-        outdir):
+        outdir,
+        track_cache=None,
+        table_format='csv',
+        probe_store=None,
+        build=DEFAULT_BUILD):
     assert os.path.isfile(target_bed)
     assert os.path.isfile(anno_bed)
     random_int = random.randint(0, 99999)
     logger = configure_logger(random_int)
-    querry_filename = outdir + "/" + "tmp" + str(random_int) + ".querry.bed"
-    anno_filename = outdir + "/" + "tmp." + anno_name + ".bed"
-    tmp_querry_bed = create_tmp_bed(target_bed,
-                                    "querry",
-                                    querry_filename,
-                                    logger)
-    tmp_anno_bed = create_tmp_bed(anno_bed,
-                                  anno_name,
-                                  anno_filename,
-                                  logger)
-    overlap_count_bed = bedtools_overlap(querry_filename,
-                                         anno_filename,
+    querry_df = read_bed_frame(target_bed, "querry")
+    logger.info("read querry bed file {0}".format(target_bed))
+    if probe_store:
+        store = ProbeStore(probe_store, build)
+        out_df = store.track_overlap(querry_df, anno_bed, anno_name,
+                                     lambda: track_index(anno_bed, anno_name, track_cache))
+        store.close()
+        logger.info("annotated from probe store {0}".format(probe_store))
+        write_overlap(out_df, anno_name, outdir, logger, table_format)
+        return
+    anno_index = track_index(anno_bed, anno_name, track_cache)
+    logger.info("read annotation bed file {0}".format(anno_bed))
+    overlap_count_bed = bedtools_overlap(querry_df,
+                                         anno_index,
                                          anno_name,
                                          outdir,
-                                         logger)
-    os.remove(querry_filename)
-    os.remove(anno_filename)
+                                         logger,
+                                         table_format)
 
 def configure_logger(value):
     """
@@ -92,140 +112,22 @@ def configure_logger(value):
     return logger
 
     
-class BedFile(object):
-
-    def __init__(self, chrom, start, stop, anno):
-        self.chrom = chrom
-        self.start =  start
-        self.stop  = stop
-        self.anno = anno
-        
-    def __iter__(self):
-        return self
-    
-    def _chrom(self):
-        if self.chrom.startswith("chr"):
-            return self.chrom.strip()
-        else:
-            new_chrom = "chr" + self.chrom.strip()
-            return new_chrom
-
-    def _start(self):
-        if self.start.isnumeric():
-            return(self.start.strip())
-        else:
-            if isinstance(int(self.start), int):
-                return(self.stop.strip())
-            else:
-                print("start position is not an integer {0}".format(self.start))
-                exit(1)
-
-    def _stop(self):
-        if self.stop.isnumeric():
-            return self.stop
-        else:
-            if isinstance(int(self.stop), int):
-                return self.stop
-            else:
-                print("stop position is not an integer {0}".format(self.stop))
-                exit(1)        
-    
-    def _anno(self):
-        if self.anno:
-            return self.anno
-    
-    def _compute_length(self):
-        length = int(self.stop) - int(self.start) 
-        return length
-
-    
-def create_tmp_bed(bed_file,
-                   anno,
-                   tmp_filename,
-                   logger):
-    if bed_file.endswith("gz"):
-        with gzip.open(bed_file, 'rt') as fh:
-            logger.info("bed file in gzip format {0}".format(bed_file))
-            BedLine = fh.readlines()
-            parse_bed(BedLine,
-                      anno,
-                      tmp_filename,
-                      logger)
-    else:
-        with open(bed_file, 'rb') as fh:
-            lines = [x.decode('utf8').strip() for x in fh.readlines()]
-            parse_bed(lines,
-                      anno,
-                      tmp_filename,
-                      logger)
-
-def parse_bed(bed,
-              anno,
-              tmp_filename,
-              logger):
-    with open(tmp_filename, 'w') as fout:
-        for line in bed:
-            try:
-                chrom = line.split('\t')[0].strip()
-                start = line.split('\t')[1].strip()
-                stop = line.split('\t')[2].strip()
-                get_bed = BedFile(chrom,
-                                  start,
-                                  stop,
-                                  anno)
-                tmp_chrom = get_bed._chrom()
-                tmp_start = get_bed._start()
-                tmp_stop = get_bed._stop()
-                tmp_anno = get_bed._anno()
-                reg_length = get_bed._compute_length()
-                out = [tmp_chrom,
-                       tmp_start,
-                       tmp_stop,
-                       tmp_anno,
-                       reg_length]
-                fout.write('\t'.join(str(i) for i in out) + '\n')
-            except IndexError:
-                logger.debug("bed file is not in valid bed format {0}".format(bed))
-                exit(1)
-            
-            
-def bedtools_overlap(querry_tmp,
-                     anno_tmp,
+def bedtools_overlap(querry_df,
+                     anno_index,
                      anno_name,
                      outdir,
-                     logger):
-    assert os.path.isfile(querry_tmp)
-    assert os.path.isfile(anno_tmp)
-    querry_tmp_bed = pybedtools.BedTool(querry_tmp)
-    a  = querry_tmp_bed.intersect(anno_tmp, wo=True)
-    if a:
-        b =  a.to_dataframe(names=['chrom',
-                                   'start',
-                                   'end',
-                                   'querry',
-                                   'length',
-                                   'anno_chrom',
-                                   'anno_start',
-                                   'anno_end',
-                                   'anno',
-                                   'anno_length',
-                                   'overlap'])
-        b[anno_name +'.PO'] = b['overlap']/b['length']
-        b[anno_name + '.RPO'] = b['overlap']/b['anno_length']
-        req_cols = ['chrom',
-                    'start',
-                    'end',
-                    anno_name +'.PO',
-                    anno_name + '.RPO']
-        out_df = b[req_cols]
-        out_df  = out_df.groupby(['chrom', 'start', 'end'], as_index=False).mean()
-        out_df = out_df.drop_duplicates()
-        out_df[anno_name +'.PO'] = round(out_df[anno_name +'.PO'],3)
-        out_df[anno_name +'.RPO'] = round(out_df[anno_name +'.RPO'],3)    
-        outfile = outdir + "/" + anno_name+".PO.tsv"
-        out_df.to_csv(outfile, sep='\t', index=False)
+                     logger,
+                     table_format='csv'):
+    out_df = track_overlap(querry_df, anno_index, anno_name)
+    write_overlap(out_df, anno_name, outdir, logger, table_format)
+
+
+def write_overlap(out_df, anno_name, outdir, logger, table_format='csv'):
+    if len(out_df):
+        outfile = outdir + "/" + anno_name + ".PO" + table_suffix(table_format, '\t')
+        write_table(out_df, outfile, table_format, sep='\t')
     else:
-        logger.debug("bedtools intersect failed {0}".format(anno_tmp))
+        logger.debug("no overlap with annotation track {0}".format(anno_name))
 
         
 if __name__ == "__main__":
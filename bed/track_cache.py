@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""
+This script compiles annotation bed tracks into
+a binary cache of per chromosome start sorted
+arrays that annotation runs memory map instead
+of parsing the bed text again
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from bed.overlap import IntervalIndex
+from bed.bed_reader import read_bed_frame
+
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def main():
+    args = parse_args()
+    run(args.anno_beds,
+        args.track_cache)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('anno_beds', nargs='+',
+                        help="annotation bed tracks to compile")
+    parser.add_argument('-c', dest='track_cache',
+                        help="track cache directory",
+                        required=True)
+    args = parser.parse_args()
+    return args
+
+
+def run(anno_beds, track_cache):
+    for anno_bed in anno_beds:
+        assert os.path.isfile(anno_bed)
+        track_dir = compile_track(anno_bed, track_cache)
+        print(track_dir)
+
+
+def file_digest(bed_file, track_cache):
+    """
+    sha256 of the source file, remembered against its
+    size and mtime so an unchanged file is not re-hashed
+    """
+    stat = os.stat(bed_file)
+    source = os.path.abspath(bed_file)
+    stat_dir = os.path.join(track_cache, 'sources')
+    stat_file = os.path.join(stat_dir, hashlib.sha1(source.encode()).hexdigest() + '.json')
+    if os.path.isfile(stat_file):
+        with open(stat_file) as fh:
+            known = json.load(fh)
+        if known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['sha256']
+    sha = hashlib.sha256()
+    with open(bed_file, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+    os.makedirs(stat_dir, exist_ok=True)
+    _write_json(stat_file, {'source': source,
+                            'size': stat.st_size,
+                            'mtime_ns': stat.st_mtime_ns,
+                            'sha256': digest})
+    return digest
+
+
+def _write_json(filename, value):
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(filename))
+    with os.fdopen(fd, 'w') as fout:
+        json.dump(value, fout)
+    os.replace(tmp_name, filename)
+
+
+def _track_prefix(bed_file):
+    source = hashlib.sha1(os.path.abspath(bed_file).encode()).hexdigest()
+    return os.path.basename(bed_file) + '.' + source[:8] + '.'
+
+
+def compile_track(bed_file, track_cache, loader=read_bed_frame):
+    """
+    write starts, ends and running max ends of every
+    chromosome as one array each plus an offset index,
+    loader parses the bed into chrom, start, end columns
+    """
+    os.makedirs(track_cache, exist_ok=True)
+    digest = file_digest(bed_file, track_cache)
+    track_dir = os.path.join(track_cache, _track_prefix(bed_file) + digest[:16])
+    if os.path.isfile(os.path.join(track_dir, 'index.json')):
+        return track_dir
+    anno_df = loader(bed_file)
+    index = IntervalIndex(anno_df['chrom'].values,
+                          anno_df['start'].values,
+                          anno_df['end'].values)
+    chroms = []
+    offset = 0
+    for chrom, (starts, ends, max_ends) in index.tracks.items():
+        chroms.append([chrom, offset, len(starts)])
+        offset += len(starts)
+    arrays = {}
+    for n, name in enumerate(('starts', 'ends', 'max_ends')):
+        values = [track[n] for track in index.tracks.values()]
+        values = np.concatenate(values) if values else np.zeros(0, dtype=np.int64)
+        dtype = np.int32 if not len(values) or values.max() <= INT32_MAX else np.int64
+        arrays[name] = values.astype(dtype)
+    tmp_dir = tempfile.mkdtemp(dir=track_cache)
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp_dir, name + '.npy'), values)
+    _write_json(os.path.join(tmp_dir, 'index.json'),
+                {'source': os.path.abspath(bed_file),
+                 'sha256': digest,
+                 'chroms': chroms})
+    try:
+        os.rename(tmp_dir, track_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir)
+    remove_stale(bed_file, track_cache, track_dir)
+    return track_dir
+
+
+def remove_stale(bed_file, track_cache, track_dir):
+    """
+    drop compiled versions of an earlier source file
+    """
+    prefix = _track_prefix(bed_file)
+    for name in os.listdir(track_cache):
+        path = os.path.join(track_cache, name)
+        if (name.startswith(prefix) and len(name) == len(prefix) + 16
+                and path != track_dir and os.path.isdir(path)):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def load_track(bed_file, track_cache, loader=read_bed_frame):
+    """
+    memory mapped interval index of a track, compiled
+    first when the cache has no copy of this source
+    """
+    track_dir = compile_track(bed_file, track_cache, loader)
+    with open(os.path.join(track_dir, 'index.json')) as fh:
+        meta = json.load(fh)
+    starts = np.load(os.path.join(track_dir, 'starts.npy'), mmap_mode='r')
+    ends = np.load(os.path.join(track_dir, 'ends.npy'), mmap_mode='r')
+    max_ends = np.load(os.path.join(track_dir, 'max_ends.npy'), mmap_mode='r')
+    index = IntervalIndex()
+    for chrom, offset, count in meta['chroms']:
+        index.add_track(chrom,
+                        starts[offset:offset + count],
+                        ends[offset:offset + count],
+                        max_ends[offset:offset + count])
+    return index
+
+
+def track_index(bed_file, anno_name=None, track_cache=None):
+    """
+    interval index of a track, memory mapped from the
+    cache when one is given
+    """
+    if track_cache:
+        return load_track(bed_file, track_cache)
+    anno_df = read_bed_frame(bed_file, anno_name)
+    return IntervalIndex(anno_df['chrom'].values,
+                         anno_df['start'].values,
+                         anno_df['end'].values)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""
+Benchmark cases, every case imports its stage and
+reads its inputs before the clock and the memory
+baseline start, only the returned call is measured,
+this module imports nothing heavy so a fresh worker
+process starts light
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import logging
+import os
+import platform
+import resource
+import tempfile
+import time
+import warnings
+
+
+def case_extract(inputs, out_dir, processes):
+    """
+    index_out_bam and modify_dict over the probe bed
+    """
+    from bam.extract_bam_summary import read_bed, index_out_bam, modify_dict
+    bed_list = read_bed(inputs['probes'])
+
+    def work():
+        bed_metrics_dict, read_depth_dict = index_out_bam(inputs['bam'], bed_list, processes)
+        modify_dict(bed_metrics_dict, read_depth_dict)
+    return work
+
+
+def case_overlap(inputs, out_dir, processes):
+    """
+    track index and bedtools_overlap of every track
+    """
+    from bed.bed_reader import read_bed_frame
+    from bed.scores_anno import bedtools_overlap
+    from bed.track_cache import track_index
+    logger = logging.getLogger('benchmarks')
+    logger.addHandler(logging.NullHandler())
+    querry_df = read_bed_frame(inputs['probes'], 'querry')
+
+    def work():
+        for track_file in inputs['tracks']:
+            anno_name = os.path.basename(track_file).split('.')[0]
+            bedtools_overlap(querry_df, track_index(track_file, anno_name), anno_name,
+                             out_dir, logger)
+    return work
+
+
+def case_combine(inputs, out_dir, processes):
+    """
+    merge_chunk_tsv of the per track overlap tables
+    """
+    from bed.combine_bed_annotation import merge_chunk_tsv
+
+    def work():
+        merge_chunk_tsv(inputs['overlaps'], inputs['probes'],
+                        os.path.join(out_dir, 'combined.tsv'))
+    return work
+
+
+def case_merge(inputs, out_dir, processes):
+    """
+    merge_chunk_csv of the metrics chunks
+    """
+    from bam.merge_chuncks import merge_chunk_csv
+
+    def work():
+        merge_chunk_csv(inputs['chunks'], out_dir, 'outfile.txt')
+    return work
+
+
+def case_score(inputs, out_dir, processes):
+    """
+    HomologyModel.score_frame of the feature table
+    """
+    import pandas as pd
+    from model.inference import HomologyModel
+    df = pd.read_parquet(inputs['features'])
+    with warnings.catch_warnings():
+        # the shipped model and scaler were pickled by newer versions
+        warnings.simplefilter('ignore')
+        model = HomologyModel(threads=processes)
+
+    def work():
+        model.score_frame(df)
+    return work
+
+
+def case_extract_b37(inputs, out_dir, processes):
+    """
+    case_extract over b37 named contigs
+    """
+    return case_extract(dict(inputs, bam=inputs['b37_bam'], probes=inputs['b37_probes']),
+                        out_dir, processes)
+
+
+def case_overlap_b37(inputs, out_dir, processes):
+    """
+    case_overlap of b37 named probes against chr named tracks
+    """
+    return case_overlap(dict(inputs, probes=inputs['b37_probes']), out_dir, processes)
+
+
+def case_merge_mixed(inputs, out_dir, processes):
+    """
+    case_merge of chunks whose columns come in the fixed
+    or in a data dependent order
+    """
+    return case_merge(dict(inputs, chunks=inputs['mixed_chunks']), out_dir, processes)
+
+
+CASES = {'extract': case_extract,
+         'extract_b37': case_extract_b37,
+         'overlap': case_overlap,
+         'overlap_b37': case_overlap_b37,
+         'combine': case_combine,
+         'merge': case_merge,
+         'merge_mixed': case_merge_mixed,
+         'score': case_score}
+
+
+def max_rss_mb(who=resource.RUSAGE_SELF):
+    """
+    peak rss, VmHWM of the process on linux as ru_maxrss
+    keeps the peak of the parent across fork and exec
+    """
+    if who == resource.RUSAGE_SELF and os.path.isfile('/proc/self/status'):
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    scale = 1 << 20 if platform.system() == 'Darwin' else 1 << 10
+    return resource.getrusage(who).ru_maxrss / scale
+
+
+def run_case(case, inputs, processes=1):
+    """
+    seconds, baseline and peak rss of one run, meant to
+    be called in a fresh process, children of a parallel
+    extraction count towards the peak
+    """
+    with tempfile.TemporaryDirectory(dir=inputs['dir']) as out_dir:
+        work = CASES[case](inputs, out_dir, processes)
+        baseline = max_rss_mb()
+        started = time.perf_counter()
+        work()
+        seconds = time.perf_counter() - started
+    peak = max_rss_mb()
+    if processes > 1:
+        peak = max(peak, max_rss_mb(resource.RUSAGE_CHILDREN))
+    return seconds, baseline, peak
+
+
+def report_case(queue, case, inputs, processes=1):
+    """
+    run_case in a worker process, the result or the error
+    goes back on the queue
+    """
+    try:
+        queue.put(('ok', run_case(case, inputs, processes)))
+    except Exception as error:
+        queue.put(('error', '{0}: {1}'.format(type(error).__name__, error)))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""
+This script compares two benchmark json files, one
+line per scale and case with the best seconds and peak
+memory of both and the ratio new / old
+
+python -m benchmarks.compare old.json new.json
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+import json
+
+
+def main():
+    args = parse_args()
+    run(args.old_json, args.new_json)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old_json', help="baseline results of benchmarks.run")
+    parser.add_argument('new_json', help="results to compare with the baseline")
+    args = parser.parse_args()
+    return args
+
+
+def read_results(filename):
+    with open(filename) as fh:
+        data = json.load(fh)
+    return data['environment'], {(r['scale'], r['case']): r for r in data['results']}
+
+
+def run(old_json, new_json):
+    old_env, old_results = read_results(old_json)
+    new_env, new_results = read_results(new_json)
+    print("old {0} new {1}".format(old_env.get('commit'), new_env.get('commit')))
+    print('\t'.join(['scale', 'case', 'old_s', 'new_s', 'time_ratio',
+                     'old_peak_mb', 'new_peak_mb', 'peak_ratio']))
+    for key in sorted(set(old_results) & set(new_results)):
+        old, new = old_results[key], new_results[key]
+        print('\t'.join(list(key) + ['{0:.3f}'.format(old['best_seconds']),
+                                     '{0:.3f}'.format(new['best_seconds']),
+                                     '{0:.2f}'.format(new['best_seconds'] / old['best_seconds']),
+                                     '{0:.0f}'.format(old['peak_rss_mb']),
+                                     '{0:.0f}'.format(new['peak_rss_mb']),
+                                     '{0:.2f}'.format(new['peak_rss_mb'] / old['peak_rss_mb'])]))
+
+
+if __name__ == "__main__":
+    main()
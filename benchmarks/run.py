@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+"""
+This script benchmarks the pipeline stages on
+synthetic inputs at several scales, every measurement
+runs in a fresh process so its peak memory is its own,
+and the results are written as json to compare commits
+
+python -m benchmarks.run -o bench.json [--scales small,medium] [--cases extract,score]
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import queue as queue_errors
+import statistics
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+import pysam
+import xgboost
+from benchmarks import synthetic
+from benchmarks.cases import CASES, report_case
+
+SCALES = {'small': {'reads': 20000, 'probes': 2000, 'track_intervals': 20000,
+                    'tracks': 4, 'chunks': 20, 'chunk_rows': 2000, 'score_rows': 100000},
+          'medium': {'reads': 200000, 'probes': 20000, 'track_intervals': 200000,
+                     'tracks': 8, 'chunks': 50, 'chunk_rows': 20000, 'score_rows': 1000000},
+          'large': {'reads': 2000000, 'probes': 100000, 'track_intervals': 1000000,
+                    'tracks': 16, 'chunks': 100, 'chunk_rows': 100000, 'score_rows': 5000000}}
+N_CHROMS = 4
+CHROM_LENGTH = 5000000
+POLL_SECONDS = 5
+
+
+def main():
+    args = parse_args()
+    run(args.outname,
+        args.scales.split(','),
+        args.cases.split(','),
+        args.repeats,
+        args.work_dir,
+        args.processes,
+        args.seed)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', dest='outname',
+                        help="json results",
+                        required=True)
+    parser.add_argument('--scales', dest='scales',
+                        help="comma separated scales of {0}".format(', '.join(SCALES)),
+                        default='small,medium')
+    parser.add_argument('--cases', dest='cases',
+                        help="comma separated stages of {0}".format(', '.join(CASES)),
+                        default=','.join(CASES))
+    parser.add_argument('-r', dest='repeats', type=int,
+                        help="runs of every case",
+                        default=3)
+    parser.add_argument('-w', dest='work_dir',
+                        help="keep the synthetic inputs here and reuse them, a temporary dir when not given",
+                        default=None)
+    parser.add_argument('-p', dest='processes', type=int,
+                        help="processes of the bam extraction",
+                        default=1)
+    parser.add_argument('--seed', dest='seed', type=int,
+                        help="seed of the synthetic inputs",
+                        default=0)
+    args = parser.parse_args()
+    return args
+
+
+def run(outname, scales, cases, repeats=3, work_dir=None, processes=1, seed=0):
+    for value in scales:
+        if value not in SCALES:
+            raise ValueError("unknown scale {0}".format(value))
+    for value in cases:
+        if value not in CASES:
+            raise ValueError("unknown case {0}".format(value))
+    tmp_dir = None
+    if work_dir is None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix='clinray_bench')
+        work_dir = tmp_dir.name
+    results = []
+    try:
+        for scale in scales:
+            inputs = make_inputs(os.path.join(work_dir, scale), SCALES[scale], seed)
+            for case in cases:
+                result = measure(case, inputs, repeats, processes)
+                result.update(scale=scale, params=SCALES[scale])
+                print("{0} {1} best {2:.3f}s median {3:.3f}s peak {4:.0f} MB (+{5:.0f} MB)".format(
+                    scale, case, result['best_seconds'], result['median_seconds'],
+                    result['peak_rss_mb'], result['peak_delta_mb']))
+                results.append(result)
+    finally:
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+    with open(outname, 'w') as fout:
+        json.dump({'environment': environment(), 'results': results}, fout, indent=1)
+
+
+def make_inputs(scale_dir, params, seed=0):
+    """
+    synthetic inputs of one scale, files already in
+    scale_dir are reused
+    """
+    os.makedirs(scale_dir, exist_ok=True)
+    inputs = {'dir': scale_dir,
+              'bam': os.path.join(scale_dir, 'sample.bam'),
+              'probes': os.path.join(scale_dir, 'probes.bed'),
+              'tracks': [os.path.join(scale_dir, 'track{0}.bed.gz'.format(n))
+                         for n in range(params['tracks'])],
+              'overlaps': os.path.join(scale_dir, 'overlaps'),
+              'chunks': os.path.join(scale_dir, 'chunks'),
+              'features': os.path.join(scale_dir, 'features.parquet'),
+              'b37_bam': os.path.join(scale_dir, 'sample.b37.bam'),
+              'b37_probes': os.path.join(scale_dir, 'probes.b37.bed'),
+              'mixed_chunks': os.path.join(scale_dir, 'mixed_chunks')}
+    if not os.path.isfile(inputs['bam'] + '.bai'):
+        synthetic.write_bam(inputs['bam'], params['reads'], N_CHROMS, CHROM_LENGTH, seed)
+    if not os.path.isfile(inputs['probes']):
+        synthetic.write_probe_bed(inputs['probes'], params['probes'], N_CHROMS, CHROM_LENGTH, seed)
+    # b37 named contigs, the tracks stay chr named
+    if not os.path.isfile(inputs['b37_bam'] + '.bai'):
+        synthetic.write_bam(inputs['b37_bam'], params['reads'], N_CHROMS, CHROM_LENGTH, seed,
+                            prefix='')
+    if not os.path.isfile(inputs['b37_probes']):
+        synthetic.write_probe_bed(inputs['b37_probes'], params['probes'], N_CHROMS,
+                                  CHROM_LENGTH, seed, prefix='')
+    for n, track_file in enumerate(inputs['tracks']):
+        if not os.path.isfile(track_file):
+            synthetic.write_track(track_file, params['track_intervals'], N_CHROMS,
+                                  CHROM_LENGTH, seed + n)
+    if not os.path.isdir(inputs['overlaps']):
+        synthetic.write_overlap_tables(inputs['overlaps'], inputs['probes'], inputs['tracks'])
+    if not os.path.isdir(inputs['chunks']):
+        synthetic.write_metrics_chunks(inputs['chunks'], params['chunks'],
+                                       params['chunk_rows'], seed)
+    if not os.path.isdir(inputs['mixed_chunks']):
+        synthetic.write_metrics_chunks(inputs['mixed_chunks'], params['chunks'],
+                                       params['chunk_rows'], seed, mixed=True)
+    if not os.path.isfile(inputs['features']):
+        synthetic.feature_frame(params['score_rows'], seed=seed).to_parquet(inputs['features'])
+    return inputs
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {'commit': commit or None,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'pysam': pysam.__version__,
+            'xgboost': xgboost.__version__}
+
+
+def wait_result(queue, worker, case):
+    """
+    result of a worker, raises when it exits without one,
+    as when it is killed for running out of memory
+    """
+    while True:
+        try:
+            return queue.get(timeout=POLL_SECONDS)
+        except queue_errors.Empty:
+            if worker.is_alive():
+                continue
+        # a result put just before exiting can still be in the pipe
+        try:
+            return queue.get(timeout=POLL_SECONDS)
+        except queue_errors.Empty:
+            worker.join()
+            raise RuntimeError("benchmark {0} worker exited with code {1} "
+                               "and no result".format(case, worker.exitcode))
+
+
+def measure(case, inputs, repeats=3, processes=1):
+    """
+    best and median seconds, and the highest peak rss and
+    growth over the baseline, of repeats runs of a case
+    """
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeats):
+        # not a Pool, its daemonic workers cannot start the extraction processes
+        queue = context.Queue()
+        worker = context.Process(target=report_case, args=(queue, case, inputs, processes))
+        worker.start()
+        status, value = wait_result(queue, worker, case)
+        worker.join()
+        if status != 'ok':
+            raise RuntimeError("benchmark {0} failed, {1}".format(case, value))
+        runs.append(value)
+    seconds = [r[0] for r in runs]
+    return {'case': case,
+            'seconds': seconds,
+            'best_seconds': min(seconds),
+            'median_seconds': statistics.median(seconds),
+            'baseline_rss_mb': max(r[1] for r in runs),
+            'peak_rss_mb': max(r[2] for r in runs),
+            'peak_delta_mb': max(r[2] - r[1] for r in runs)}
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""
+Synthetic inputs for the benchmarks, generated offline
+from a seed, coordinate sorted and indexed bams with
+AS, XS and MQ tags, probe beds, gzip stratification
+tracks, per track overlap tables, metrics chunks and
+model feature tables, contigs are chr named or b37
+named and metrics columns in the fixed or in a data
+dependent order
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import gzip
+import os
+import numpy as np
+import pandas as pd
+import pysam
+from bam.extract_bam_summary import metrics_columns
+from bed.bed_reader import read_bed_frame
+from bed.overlap import track_overlap
+from bed.track_cache import track_index
+from model.inference import DEFAULT_COLUMNS, read_list
+from pipeline.table_io import write_table
+
+READ_LENGTH = 100
+CIGARS = ('100M', '50M10D50M', '20S80M', '60M2I38M')
+FLAGS = (99, 147, 83, 163, 97, 1123, 355, 2147)
+
+
+def chrom_names(n_chroms, prefix='chr'):
+    """
+    chr1, chr2, ... or 1, 2, ... as in b37 with no prefix
+    """
+    return ['{0}{1}'.format(prefix, i + 1) for i in range(n_chroms)]
+
+
+def write_bam(bam_file, n_reads, n_chroms=2, chrom_length=1000000, seed=0, prefix='chr'):
+    """
+    n_reads paired style reads spread over n_chroms,
+    sorted and indexed, about 30% of reads lack MQ
+    """
+    rng = np.random.default_rng(seed)
+    chroms = chrom_names(n_chroms, prefix)
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+              'SQ': [{'SN': chrom, 'LN': chrom_length} for chrom in chroms]}
+    tids = np.sort(rng.integers(0, n_chroms, n_reads))
+    starts = rng.integers(0, chrom_length - 2 * READ_LENGTH, n_reads)
+    order = np.lexsort((starts, tids))
+    tids, starts = tids[order], starts[order]
+    mapqs = rng.integers(0, 61, n_reads)
+    mate_mapqs = rng.integers(0, 61, n_reads)
+    has_mq = rng.random(n_reads) < 0.7
+    align_scores = rng.integers(0, READ_LENGTH + 1, n_reads)
+    sub_scores = rng.integers(0, READ_LENGTH + 1, n_reads)
+    isizes = rng.integers(-600, 600, n_reads)
+    flags = rng.choice(FLAGS, n_reads)
+    cigars = rng.choice(len(CIGARS), n_reads)
+    sequence = 'A' * READ_LENGTH
+    qualities = pysam.qualitystring_to_array('I' * READ_LENGTH)
+    with pysam.AlignmentFile(bam_file, 'wb', header=header) as fout:
+        for n in range(n_reads):
+            read = pysam.AlignedSegment(fout.header)
+            read.query_name = 'r{0}'.format(n)
+            read.query_sequence = sequence
+            read.flag = int(flags[n])
+            read.reference_id = int(tids[n])
+            read.reference_start = int(starts[n])
+            read.mapping_quality = int(mapqs[n])
+            read.cigarstring = CIGARS[cigars[n]]
+            read.next_reference_id = int(tids[n])
+            read.next_reference_start = int(starts[n]) + 2 * READ_LENGTH
+            read.template_length = int(isizes[n])
+            read.query_qualities = qualities
+            tags = [('AS', int(align_scores[n])), ('XS', int(sub_scores[n]))]
+            if has_mq[n]:
+                tags.append(('MQ', int(mate_mapqs[n])))
+            read.set_tags(tags)
+            fout.write(read)
+    pysam.index(bam_file)
+    return bam_file
+
+
+def random_intervals(n, n_chroms, chrom_length, min_length, max_length, rng, prefix='chr'):
+    chroms = np.array(chrom_names(n_chroms, prefix))[rng.integers(0, n_chroms, n)]
+    lengths = rng.integers(min_length, max_length + 1, n)
+    starts = rng.integers(0, chrom_length - max_length, n)
+    return pd.DataFrame({'chrom': chroms, 'start': starts, 'end': starts + lengths})
+
+
+def write_probe_bed(bed_file, n_probes, n_chroms=2, chrom_length=1000000, seed=0,
+                    prefix='chr'):
+    """
+    probe bed in the querry layout, chrom start end gene
+    number strand
+    """
+    rng = np.random.default_rng(seed)
+    df = random_intervals(n_probes, n_chroms, chrom_length, 80, 400, rng, prefix)
+    df = df.sort_values(['chrom', 'start']).reset_index(drop=True)
+    df['gene'] = ['G{0}'.format(i // 20) for i in range(len(df))]
+    df['number'] = np.arange(len(df)) % 20 + 1
+    df['strand'] = rng.choice(['+', '-'], len(df))
+    df.to_csv(bed_file, sep='\t', header=False, index=False)
+    return bed_file
+
+
+def write_track(bed_file, n_intervals, n_chroms=2, chrom_length=1000000, seed=0):
+    """
+    gzip stratification track of n_intervals sorted regions
+    """
+    rng = np.random.default_rng(seed)
+    df = random_intervals(n_intervals, n_chroms, chrom_length, 1, 5000, rng)
+    df = df.sort_values(['chrom', 'start'])
+    with gzip.open(bed_file, 'wt') as fout:
+        df.to_csv(fout, sep='\t', header=False, index=False)
+    return bed_file
+
+
+def write_overlap_tables(out_dir, probe_bed, track_files):
+    """
+    <anno>.PO.tsv of every track against the probes, the
+    input of combine_bed_annotation
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    querry_df = read_bed_frame(probe_bed, 'querry')
+    for track_file in track_files:
+        anno_name = os.path.basename(track_file).split('.')[0]
+        out_df = track_overlap(querry_df, track_index(track_file, anno_name), anno_name)
+        out_df.to_csv(os.path.join(out_dir, anno_name + '.PO.tsv'), sep='\t', index=False)
+    return out_dir
+
+
+def data_order(columns, late=('XS',)):
+    """
+    columns in the order of a table built from probe rows
+    whose first probe lacks the late tags, their stats
+    come after the stats of every other field
+    """
+    is_late = [c.split('_')[0] in late and c.endswith(('_median', '_mean', '_std', '_min'))
+               for c in columns]
+    early = [c for c, flag in zip(columns, is_late) if not flag]
+    stats_end = early.index('pct_count_mapq_Lt10')
+    return (early[:stats_end] + [c for c, flag in zip(columns, is_late) if flag]
+            + early[stats_end:])
+
+
+def metrics_frame(n_rows, sample_name='S1', seed=0, ordered=True):
+    """
+    metrics table with the extract_bam_summary columns, in
+    the metrics_columns order or else in data_order
+    """
+    rng = np.random.default_rng(seed)
+    columns = metrics_columns()
+    df = pd.DataFrame(rng.random((n_rows, len(columns) - 4)) * 60,
+                      columns=columns[1:-3])
+    df.insert(0, 'probe', ['chr1_{0}_{1}'.format(i * 500, i * 500 + 200) for i in range(n_rows)])
+    df['count_mapq_Lt10'] = rng.integers(0, 50, n_rows)
+    df['raw_dp'] = rng.integers(1, 500, n_rows)
+    df['SAMPLE_NAME'] = sample_name
+    return df if ordered else df[data_order(columns)]
+
+
+def write_metrics_chunks(out_dir, n_chunks, rows_per_chunk, seed=0, mixed=False):
+    """
+    n_chunks metrics csv tables, the input of merge_chuncks,
+    with mixed every other chunk has its columns in
+    data_order
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for n in range(n_chunks):
+        df = metrics_frame(rows_per_chunk, 'S{0}'.format(n), seed + n,
+                           ordered=not (mixed and n % 2))
+        write_table(df, os.path.join(out_dir, 'chunk{0:05d}.csv'.format(n)))
+    return out_dir
+
+
+def feature_frame(n_rows, columns_file=DEFAULT_COLUMNS, seed=0):
+    """
+    rows of the model feature columns, overlap fractions
+    in [0, 1] and bam metrics on their own scales
+    """
+    rng = np.random.default_rng(seed)
+    columns = read_list(columns_file)
+    df = pd.DataFrame(rng.random((n_rows, len(columns))).astype(np.float32), columns=columns)
+    for col, scale in (('AS_mean', 150), ('MAPQ_mean', 60), ('raw_dp', 1000)):
+        if col in df.columns:
+            df[col] *= scale
+    df.insert(0, 'probe', ['p{0}'.format(i) for i in range(n_rows)])
+    return df
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+
+"""
+Train the homology model with a parallel, resumable
+hyperparameter search, see model/train.py
+"""
+
+import os
+import sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isfile(os.path.join(ROOT, 'setup.py')):
+    # run from a checkout without installing
+    sys.path.insert(0, ROOT)
+from model.train import main
+
+
+if __name__ == "__main__":
+    main()
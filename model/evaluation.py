@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""
+This script computes bootstrap confidence intervals of
+the ROC AUC and average precision (PR AUC) of one or
+more models, the resamples are drawn as an index matrix
+and scored together from per sample counts instead of
+one roc_auc_score call per resample
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.stats import t, sem
+from pipeline.table_io import add_format_arg, read_table, write_table
+
+N_BOOTSTRAP = 500
+CONFIDENCE = 0.95
+CHUNK_CELLS = 1 << 24
+RESULT_COLUMNS = ['model', 'auc', 'auc_ci_low', 'auc_ci_high',
+                  'pr_auc', 'pr_auc_ci_low', 'pr_auc_ci_high', 'n_bootstrap']
+
+
+def main():
+    args = parse_args()
+    run(args.input_table,
+        args.outname,
+        args.label,
+        args.models.split(',') if args.models else None,
+        args.n_bootstrap,
+        args.confidence,
+        args.seed,
+        args.threads,
+        args.table_format)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-i', dest='input_table',
+                        help="table of the true label and one probability column per model",
+                        required=True)
+    parser.add_argument('-o', dest='outname',
+                        help="auc and pr auc with confidence intervals per model",
+                        required=True)
+    parser.add_argument('-l', dest='label',
+                        help="true label column",
+                        default='label')
+    parser.add_argument('-m', dest='models',
+                        help="comma separated probability columns, all but the label when not given",
+                        default=None)
+    parser.add_argument('-n', dest='n_bootstrap', type=int,
+                        help="number of bootstrap resamples",
+                        default=N_BOOTSTRAP)
+    parser.add_argument('--confidence', dest='confidence', type=float,
+                        help="confidence level of the t interval",
+                        default=CONFIDENCE)
+    parser.add_argument('--seed', dest='seed', type=int,
+                        help="random seed of the resamples",
+                        default=None)
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        help="number of models evaluated concurrently",
+                        default=1)
+    add_format_arg(parser)
+    args = parser.parse_args()
+    return args
+
+
+def run(input_table,
+        outname,
+        label='label',
+        models=None,
+        n_bootstrap=N_BOOTSTRAP,
+        confidence=CONFIDENCE,
+        seed=None,
+        threads=1,
+        table_format='csv'):
+    sep = '\t' if input_table.endswith('.tsv') else ','
+    df = read_table(input_table, sep=sep)
+    if models is None:
+        models = [c for c in df.columns if c != label]
+    predictions = {model: df[model].values for model in models}
+    result_df = compare_models(df[label].values, predictions, n_bootstrap,
+                               confidence, seed, threads)
+    write_table(result_df, outname, table_format)
+
+
+def resample_counts(n, n_resamples, rng):
+    """
+    times each sample is drawn in every resample, one
+    row per resample
+    """
+    idx = rng.integers(0, n, size=(n_resamples, n))
+    idx += np.arange(n_resamples)[:, None] * n
+    return np.bincount(idx.ravel(), minlength=n_resamples * n).reshape(n_resamples, n)
+
+
+def score_groups(y_true, y_pred_proba):
+    """
+    order of the samples by decreasing score, start of
+    each run of tied scores and the positive mask in
+    that order
+    """
+    y_true = np.asarray(y_true)
+    y_pred_proba = np.asarray(y_pred_proba, dtype=np.float64)
+    order = np.argsort(-y_pred_proba, kind='mergesort')
+    scores = y_pred_proba[order]
+    starts = np.flatnonzero(np.r_[True, scores[1:] != scores[:-1]])
+    return order, starts, (y_true[order] == 1)
+
+
+def bootstrap_scores(y_true, y_pred_proba, n_bootstrap=N_BOOTSTRAP, rng=None):
+    """
+    roc auc and average precision of every resample, nan
+    where a resample holds a single class
+
+    the auc counts, per run of tied scores, the negatives
+    ranked below each positive (ties count half) and the
+    average precision sums precision at every run weighted
+    by its share of the positives, as roc_auc_score and
+    average_precision_score do for the same resample
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    order, starts, positive = score_groups(y_true, y_pred_proba)
+    n = len(order)
+    aucs = np.empty(n_bootstrap)
+    pr_aucs = np.empty(n_bootstrap)
+    step = max(1, CHUNK_CELLS // max(n, 1))
+    for first in range(0, n_bootstrap, step):
+        last = min(first + step, n_bootstrap)
+        counts = resample_counts(n, last - first, rng)[:, order]
+        pos = np.add.reduceat(counts * positive, starts, axis=1).astype(np.float64)
+        neg = np.add.reduceat(counts * ~positive, starts, axis=1).astype(np.float64)
+        tp = np.cumsum(pos, axis=1)
+        fp = np.cumsum(neg, axis=1)
+        n_pos = tp[:, -1]
+        n_neg = fp[:, -1]
+        neg_below = n_neg[:, None] - fp
+        with np.errstate(invalid='ignore', divide='ignore'):
+            auc = (pos * (neg_below + 0.5 * neg)).sum(axis=1) / (n_pos * n_neg)
+            precision = np.where(pos > 0, tp / np.maximum(tp + fp, 1), 0)
+            pr_auc = (pos * precision).sum(axis=1) / n_pos
+        single = (n_pos == 0) | (n_neg == 0)
+        auc[single] = np.nan
+        pr_auc[single] = np.nan
+        aucs[first:last] = auc
+        pr_aucs[first:last] = pr_auc
+    return aucs, pr_aucs
+
+
+def mean_ci(values, confidence=CONFIDENCE):
+    values = values[~np.isnan(values)]
+    mean = np.mean(values)
+    return mean, t.interval(confidence, len(values) - 1, loc=mean, scale=sem(values))
+
+
+def calculate_auc_with_ci(y_true, y_pred_proba, n_bootstrap=N_BOOTSTRAP,
+                          confidence=CONFIDENCE, seed=None):
+    """
+    mean bootstrap auc, its t interval, mean bootstrap
+    pr auc and its t interval, as in the baseline notebook
+    """
+    aucs, pr_aucs = bootstrap_scores(y_true, y_pred_proba, n_bootstrap,
+                                     np.random.default_rng(seed))
+    auc, auc_ci = mean_ci(aucs, confidence)
+    pr_auc, pr_auc_ci = mean_ci(pr_aucs, confidence)
+    return auc, auc_ci, pr_auc, pr_auc_ci
+
+
+def _evaluate(args):
+    model, y_true, y_pred_proba, n_bootstrap, confidence, seed = args
+    auc, auc_ci, pr_auc, pr_auc_ci = calculate_auc_with_ci(y_true, y_pred_proba, n_bootstrap,
+                                                           confidence, seed)
+    return [model, auc, auc_ci[0], auc_ci[1], pr_auc, pr_auc_ci[0], pr_auc_ci[1], n_bootstrap]
+
+
+def compare_models(y_true, predictions, n_bootstrap=N_BOOTSTRAP,
+                   confidence=CONFIDENCE, seed=None, threads=1):
+    """
+    one row of auc and pr auc intervals per model in
+    predictions, a dict of model name to probabilities,
+    every model gets its own seed spawned from seed so the
+    result does not depend on the number of workers
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(predictions))
+    tasks = [(model, y_true, y_pred_proba, n_bootstrap, confidence, model_seed)
+             for (model, y_pred_proba), model_seed in zip(predictions.items(), seeds)]
+    if threads > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=threads) as executor:
+            rows = list(executor.map(_evaluate, tasks))
+    else:
+        rows = [_evaluate(task) for task in tasks]
+    return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+"""
+This script selects the training features as the
+notebook does, numeric columns above a variance
+threshold with correlated columns pruned, the
+correlation is computed once as a matrix product of
+the standardised columns and only its mask above the
+threshold is kept
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+import numpy as np
+from pipeline.table_io import read_table
+
+CORRELATION_THRESHOLD = 0.9
+VARIANCE_THRESHOLD = 0.05
+CHUNK_COLUMNS = 2048
+BORDER_BAND = 1e-4
+
+
+def main():
+    args = parse_args()
+    run(args.input_table,
+        args.outname,
+        args.label,
+        args.threshold,
+        args.variance_threshold,
+        args.exclude_file,
+        args.chunk_columns)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-i', dest='input_table',
+                        help="labelled training table",
+                        required=True)
+    parser.add_argument('-o', dest='outname',
+                        help="selected features, one per line",
+                        required=True)
+    parser.add_argument('-l', dest='label',
+                        help="label column, never selected",
+                        default='Class')
+    parser.add_argument('--threshold', dest='threshold', type=float,
+                        help="correlation at or above which the later column is dropped",
+                        default=CORRELATION_THRESHOLD)
+    parser.add_argument('--variance-threshold', dest='variance_threshold', type=float,
+                        help="columns with this variance or less are dropped first",
+                        default=VARIANCE_THRESHOLD)
+    parser.add_argument('-e', dest='exclude_file',
+                        help="columns to leave out, one per line",
+                        default=None)
+    parser.add_argument('--chunk-columns', dest='chunk_columns', type=int,
+                        help="columns of the correlation matrix computed at a time",
+                        default=CHUNK_COLUMNS)
+    args = parser.parse_args()
+    return args
+
+
+def run(input_table,
+        outname,
+        label='Class',
+        threshold=CORRELATION_THRESHOLD,
+        variance_threshold=VARIANCE_THRESHOLD,
+        exclude_file=None,
+        chunk_columns=CHUNK_COLUMNS):
+    sep = '\t' if input_table.endswith('.tsv') else ','
+    df = read_table(input_table, sep=sep)
+    exclude = [label]
+    if exclude_file:
+        with open(exclude_file) as fh:
+            exclude += [line.strip() for line in fh if line.strip()]
+    features = select_features(df, exclude, threshold, variance_threshold, chunk_columns)
+    with open(outname, 'w') as fout:
+        for feature in features:
+            fout.write(feature + '\n')
+
+
+def select_features(df,
+                    exclude=(),
+                    threshold=CORRELATION_THRESHOLD,
+                    variance_threshold=VARIANCE_THRESHOLD,
+                    chunk_columns=CHUNK_COLUMNS):
+    """
+    numeric columns not excluded, with variance above the
+    threshold, after correlation pruning
+    """
+    data_df = df.select_dtypes(include=np.number)
+    data_df = data_df.drop(columns=[c for c in exclude if c in data_df.columns])
+    variance = data_df.var(ddof=0).values
+    data_df = data_df.loc[:, variance > variance_threshold]
+    return list(correlation(data_df, threshold, chunk_columns).columns)
+
+
+def _standardise(values):
+    centred = values - values.mean(axis=0)
+    norm = np.sqrt(np.einsum('ij,ij->j', centred, centred))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return centred / norm
+
+
+def correlation_mask(values, threshold, chunk_columns=CHUNK_COLUMNS):
+    """
+    boolean matrix of pearson correlation at or above the
+    threshold, columns are centred and scaled in float64
+    so large means keep their precision, column blocks of
+    the correlation are computed from the float32 cast of
+    the standardised columns and thresholded one at a time
+    so only the mask is held in full, pairs within
+    BORDER_BAND of the threshold are recomputed in float64
+    so rounding never flips a decision, constant columns
+    never match
+    """
+    exact = _standardise(np.asarray(values, dtype=np.float64))
+    n_columns = exact.shape[1]
+    standard = exact.astype(np.float32)
+    mask = np.zeros((n_columns, n_columns), dtype=bool)
+    border = []
+    for first in range(0, n_columns, chunk_columns):
+        last = min(first + chunk_columns, n_columns)
+        block = standard[:, first:last].T @ standard
+        mask[first:last] = block >= threshold
+        rows, cols = np.nonzero(np.abs(block - threshold) < BORDER_BAND)
+        border.append((rows + first, cols))
+    rows = np.concatenate([b[0] for b in border])
+    cols = np.concatenate([b[1] for b in border])
+    if len(rows):
+        exact_corr = np.einsum('ij,ij->j', exact[:, rows], exact[:, cols])
+        mask[rows, cols] = exact_corr >= threshold
+    return mask
+
+
+def correlated_columns(dataset, threshold, chunk_columns=CHUNK_COLUMNS):
+    """
+    names of the columns the notebook correlation() drops,
+    column i goes when an earlier column j that was kept
+    has corr(i, j) >= threshold, so only kept columns with
+    a match below the diagonal are visited
+    """
+    columns = list(dataset.columns)
+    if dataset.isna().values.any():
+        mask = (dataset.corr().values >= threshold)
+    else:
+        mask = correlation_mask(dataset.values, threshold, chunk_columns)
+    mask = np.tril(mask, -1)
+    dropped = np.zeros(len(columns), dtype=bool)
+    for j in np.flatnonzero(mask.any(axis=0)):
+        if not dropped[j]:
+            dropped |= mask[:, j]
+    return [c for c, drop in zip(columns, dropped) if drop]
+
+
+def correlation(dataset, threshold, chunk_columns=CHUNK_COLUMNS):
+    """
+    dataset without the correlated columns, the drops are
+    applied once and the input frame is left unchanged
+    """
+    return dataset.drop(columns=correlated_columns(dataset, threshold, chunk_columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+"""
+This script picks how many of the most important
+features the model keeps, as the notebook
+SelectFromModel sweep does, feature counts are tried
+coarse to fine in parallel worker processes and every
+fit slices one matrix of quantised bin codes built
+once, the score of every tried count is written as
+the accuracy vs features curve
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score
+from xgboost import XGBClassifier
+from model.feature_selection import select_features
+from model.inference import DEFAULT_MAPPING, read_aliases, read_list, raw_feature_matrix
+from model.train import preprocess_data
+from pipeline.table_io import add_format_arg, read_table, write_table
+
+MAX_BIN = 256
+COARSE_POINTS = 8
+SELECTION_PARAMS = {'n_estimators': 100,
+                    'max_depth': 6,
+                    'learning_rate': 0.1}
+CURVE_COLUMNS = ['total_features', 'accuracy', 'auc', 'round', 'features']
+
+
+def main():
+    args = parse_args()
+    run(args.input_table,
+        args.outname,
+        args.features_outname,
+        args.label,
+        args.columns_file,
+        args.mapping_file,
+        args.metric,
+        args.tolerance,
+        args.coarse_points,
+        args.full,
+        args.workers,
+        args.threads,
+        args.seed,
+        args.table_format)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-i', dest='input_table',
+                        help="labelled training table",
+                        required=True)
+    parser.add_argument('-o', dest='outname',
+                        help="score of every feature count tried",
+                        required=True)
+    parser.add_argument('-f', dest='features_outname',
+                        help="chosen features, one per line",
+                        default=None)
+    parser.add_argument('-l', dest='label',
+                        help="label column",
+                        default='Class')
+    parser.add_argument('--columns', dest='columns_file',
+                        help="candidate features, one per line, "
+                             "the correlation pruned numeric columns when not given",
+                        default=None)
+    parser.add_argument('--mapping', dest='mapping_file',
+                        help="feature name mapping, name=alias per line",
+                        default=DEFAULT_MAPPING)
+    parser.add_argument('--metric', dest='metric', choices=['auc', 'accuracy'],
+                        help="test split score the count is chosen by",
+                        default='auc')
+    parser.add_argument('--tolerance', dest='tolerance', type=float,
+                        help="choose the fewest features scoring within this of the best",
+                        default=0.0)
+    parser.add_argument('--coarse', dest='coarse_points', type=int,
+                        help="feature counts tried in every round",
+                        default=COARSE_POINTS)
+    parser.add_argument('--full', dest='full', action='store_true',
+                        help="try every feature count as the notebook does")
+    parser.add_argument('-p', dest='workers', type=int,
+                        help="fits run in parallel",
+                        default=1)
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        help="xgboost threads shared by the parallel fits",
+                        default=1)
+    parser.add_argument('--seed', dest='seed', type=int,
+                        help="seed of the splits",
+                        default=42)
+    add_format_arg(parser)
+    args = parser.parse_args()
+    return args
+
+
+def run(input_table,
+        outname,
+        features_outname=None,
+        label='Class',
+        columns_file=None,
+        mapping_file=DEFAULT_MAPPING,
+        metric='auc',
+        tolerance=0.0,
+        coarse_points=COARSE_POINTS,
+        full=False,
+        workers=1,
+        threads=1,
+        seed=42,
+        table_format='csv'):
+    assert os.path.isfile(input_table)
+    sep = '\t' if input_table.endswith('.tsv') else ','
+    df = read_table(input_table, sep=sep)
+    if columns_file:
+        columns = read_list(columns_file)
+    else:
+        columns = select_features(df, [label])
+    matrix = raw_feature_matrix(df, columns, read_aliases(mapping_file))
+    scaler, splits = preprocess_data(matrix, df[label].values.astype(int), random_state=seed)
+    curve_df = sweep(splits, columns, metric, tolerance, coarse_points, full, workers, threads)
+    write_table(curve_df, outname, table_format)
+    chosen = choose_count(curve_df, metric, tolerance)
+    print("{0} features, test {1} {2:.4f}".format(chosen['total_features'], metric, chosen[metric]))
+    if features_outname:
+        with open(features_outname, 'w') as fout:
+            for feature in chosen['features'].split(';'):
+                fout.write(feature + '\n')
+
+
+def quantise(X_train, X_test, max_bin=MAX_BIN):
+    """
+    uint8 bin codes of the train and test matrices from
+    per feature quantile cut points of the train split,
+    hist trees on the codes see the same bins whichever
+    columns are kept
+    """
+    cuts = [np.unique(np.quantile(X_train[:, i], np.linspace(0, 1, max_bin + 1)[1:-1]))
+            for i in range(X_train.shape[1])]
+
+    def codes(X):
+        out = np.empty(X.shape, dtype=np.uint8)
+        for i, cut in enumerate(cuts):
+            out[:, i] = np.searchsorted(cut, X[:, i], side='right')
+        return out
+
+    return codes(X_train), codes(X_test)
+
+
+def feature_counts(importances):
+    """
+    number of features SelectFromModel keeps at each
+    threshold of the sorted importances, ties are kept
+    together
+    """
+    importances = np.asarray(importances)
+    return sorted({int((importances >= thresh).sum()) for thresh in importances})
+
+
+_worker = {}
+
+
+def _init_worker(train_codes, test_codes, y_train, y_test, threads):
+    _worker.update(train_codes=train_codes, test_codes=test_codes,
+                   y_train=y_train, y_test=y_test, threads=threads)
+
+
+def score_count(order, count):
+    """
+    test accuracy and auc of the selection model on the
+    count most important features
+    """
+    keep = np.sort(order[:count])
+    model = XGBClassifier(tree_method='hist', max_bin=MAX_BIN, n_jobs=_worker['threads'],
+                          **SELECTION_PARAMS)
+    model.fit(_worker['train_codes'][:, keep], _worker['y_train'])
+    probs = model.predict_proba(_worker['test_codes'][:, keep])[:, 1]
+    accuracy = float(np.mean((probs > 0.5) == _worker['y_test']))
+    return count, accuracy, float(roc_auc_score(_worker['y_test'], probs))
+
+
+def spaced(values, points):
+    """
+    up to points values evenly spread over the sorted
+    values, first and last included
+    """
+    if len(values) <= points:
+        return list(values)
+    positions = np.unique(np.round(np.linspace(0, len(values) - 1, points)).astype(int))
+    return [values[p] for p in positions]
+
+
+def next_counts(counts, scores, points, tolerance=0.0):
+    """
+    untried counts between the neighbours of the fewest
+    tried features scoring within tolerance of the best
+    """
+    tried = sorted(scores)
+    top = max(scores.values())
+    best = min(c for c in tried if scores[c] >= top - tolerance)
+    position = tried.index(best)
+    low = tried[position - 1] if position > 0 else best
+    high = tried[position + 1] if position + 1 < len(tried) else best
+    between = [c for c in counts if low < c < high and c not in scores]
+    return spaced(between, points)
+
+
+def sweep(splits, columns, metric='auc', tolerance=0.0, coarse_points=COARSE_POINTS,
+          full=False, workers=1, threads=1):
+    """
+    rank the features with the importances of a default
+    XGBClassifier and score feature counts, every count
+    with full, otherwise an even coarse grid refined
+    around the chosen count until its neighbours are tried
+    """
+    X_train, X_val, X_test, y_train, y_val, y_test = splits
+    ranker = XGBClassifier(n_jobs=threads)
+    ranker.fit(X_train, y_train)
+    importances = ranker.feature_importances_
+    order = np.argsort(-importances, kind='stable')
+    counts = feature_counts(importances)
+    train_codes, test_codes = quantise(X_train, X_test)
+    fit_threads = max(1, threads // max(workers, 1))
+    metric_column = {'accuracy': 1, 'auc': 2}[metric]
+    rows = []
+    scores = {}
+    todo = counts if full else spaced(counts, coarse_points)
+    round_number = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(train_codes, test_codes, y_train, y_test,
+                                       fit_threads)) as executor:
+        while todo:
+            for result in executor.map(score_count, [order] * len(todo), todo):
+                scores[result[0]] = result[metric_column]
+                rows.append(list(result) + [round_number])
+            round_number += 1
+            todo = next_counts(counts, scores, coarse_points, tolerance)
+    curve_df = pd.DataFrame(rows, columns=CURVE_COLUMNS[:-1])
+    curve_df['features'] = [';'.join(columns[i] for i in order[:count])
+                            for count in curve_df['total_features']]
+    return curve_df.sort_values('total_features').reset_index(drop=True)
+
+
+def choose_count(curve_df, metric='auc', tolerance=0.0):
+    """
+    row of the fewest features scoring within tolerance of
+    the best tried count
+    """
+    best = curve_df[metric].max()
+    return curve_df[curve_df[metric] >= best - tolerance].iloc[0]
+
+
+if __name__ == "__main__":
+    main()
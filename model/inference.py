@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""
+This script scores probes with the homology model,
+the scaler and booster are loaded once and the
+feature rows are predicted in float32 batches
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+import os
+import joblib
+import numpy as np
+import pandas as pd
+from pipeline.table_io import add_format_arg, read_table, write_table
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+FEATURES_DIR = os.path.join(os.path.dirname(MODEL_DIR), 'features')
+DEFAULT_MODEL = os.path.join(MODEL_DIR, 'best_xgb_model.optuna.HPO.real.joblib')
+DEFAULT_SCALER = os.path.join(MODEL_DIR, 'model_scaler.pkl')
+DEFAULT_COLUMNS = os.path.join(FEATURES_DIR, 'model_column.ordered.list')
+DEFAULT_MAPPING = os.path.join(FEATURES_DIR, 'features_name.mapping.list')
+BATCH_SIZE = 1 << 18
+
+
+def main():
+    args = parse_args()
+    run(args.input_table,
+        args.outname,
+        args.model_file,
+        args.scaler_file,
+        args.columns_file,
+        args.mapping_file,
+        args.threads,
+        args.batch_size,
+        args.threshold,
+        args.table_format)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-i', dest='input_table',
+                        help="probe feature table, csv, tsv, parquet or feather",
+                        required=True)
+    parser.add_argument('-o', dest='outname',
+                        help="scored table",
+                        required=True)
+    parser.add_argument('-m', dest='model_file',
+                        help="xgboost model joblib",
+                        default=DEFAULT_MODEL)
+    parser.add_argument('-s', dest='scaler_file',
+                        help="fitted MinMaxScaler pickle",
+                        default=DEFAULT_SCALER)
+    parser.add_argument('--columns', dest='columns_file',
+                        help="model column order, one feature per line",
+                        default=DEFAULT_COLUMNS)
+    parser.add_argument('--mapping', dest='mapping_file',
+                        help="feature name mapping, name=alias per line",
+                        default=DEFAULT_MAPPING)
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        help="xgboost prediction threads",
+                        default=1)
+    parser.add_argument('--batch-size', dest='batch_size', type=int,
+                        help="rows per prediction batch",
+                        default=BATCH_SIZE)
+    parser.add_argument('--threshold', dest='threshold', type=float,
+                        help="probability cut off of the prediction column",
+                        default=0.5)
+    add_format_arg(parser)
+    args = parser.parse_args()
+    return args
+
+
+def run(input_table,
+        outname,
+        model_file=DEFAULT_MODEL,
+        scaler_file=DEFAULT_SCALER,
+        columns_file=DEFAULT_COLUMNS,
+        mapping_file=DEFAULT_MAPPING,
+        threads=1,
+        batch_size=BATCH_SIZE,
+        threshold=0.5,
+        table_format='csv'):
+    assert os.path.isfile(input_table)
+    sep = '\t' if input_table.endswith('.tsv') else ','
+    df = read_table(input_table, sep=sep)
+    model = HomologyModel(model_file, scaler_file, columns_file,
+                          mapping_file, threads)
+    scored_df = model.score_frame(df, batch_size, threshold)
+    write_table(scored_df, outname, table_format, sep=sep)
+
+
+def read_list(filename):
+    with open(filename) as fh:
+        return [line.strip() for line in fh if line.strip()]
+
+
+def read_mapping(filename):
+    """
+    feature name to alias, one name=alias per line
+    """
+    mapping = {}
+    for line in read_list(filename):
+        name, alias = line.split('=', 1)
+        mapping[name.strip()] = alias.strip()
+    return mapping
+
+
+def read_aliases(mapping_file=DEFAULT_MAPPING):
+    """
+    alias to feature name
+    """
+    if not mapping_file:
+        return {}
+    return {alias: name for name, alias in read_mapping(mapping_file).items()}
+
+
+def raw_feature_matrix(df, columns, aliases=None):
+    """
+    unscaled float32 rows of the given columns, alias
+    names are renamed and missing values count as 0,
+    text other than True/False raises
+    """
+    aliases = aliases or {}
+    df = df.rename(columns={k: v for k, v in aliases.items()
+                            if k in df.columns and v not in df.columns})
+    missing = [c for c in columns if c not in df.columns]
+    if missing:
+        raise ValueError("missing model features {0}".format(', '.join(missing)))
+    features = df[columns]
+    for col in features.columns[features.dtypes == object]:
+        # raw_dp is written as True for probes without reads
+        values = features[col].replace({'True': 1, 'False': 0, True: 1, False: 0})
+        try:
+            values = pd.to_numeric(values)
+        except (TypeError, ValueError):
+            raise ValueError("feature {0} has non numeric values".format(col))
+        features = features.assign(**{col: values})
+    return np.ascontiguousarray(features.to_numpy(dtype=np.float32, na_value=0))
+
+
+class HomologyModel(object):
+    """
+    scaler and booster of a trained model held in
+    memory, MinMax scaling is applied as one float32
+    multiply add on the model ordered feature matrix
+    """
+
+    def __init__(self,
+                 model_file=DEFAULT_MODEL,
+                 scaler_file=DEFAULT_SCALER,
+                 columns_file=DEFAULT_COLUMNS,
+                 mapping_file=DEFAULT_MAPPING,
+                 threads=1):
+        model = joblib.load(model_file)
+        self.booster = model.get_booster() if hasattr(model, 'get_booster') else model
+        self.booster.set_param({'nthread': threads})
+        scaler = joblib.load(scaler_file)
+        self.scale = np.asarray(scaler.scale_, dtype=np.float32)
+        self.offset = np.asarray(scaler.min_, dtype=np.float32)
+        self.columns = read_list(columns_file)
+        self.aliases = read_aliases(mapping_file)
+        n_features = self.booster.num_features()
+        if not len(self.columns) == len(self.scale) == n_features:
+            raise ValueError("model has {0} features, scaler {1} and column list {2}".format(
+                n_features, len(self.scale), len(self.columns)))
+
+    def feature_matrix(self, df):
+        """
+        scaled float32 rows in model column order, alias
+        names are renamed and missing values count as 0
+        """
+        matrix = raw_feature_matrix(df, self.columns, self.aliases)
+        matrix *= self.scale
+        matrix += self.offset
+        return matrix
+
+    def predict_matrix(self, matrix, batch_size=BATCH_SIZE):
+        """
+        probability of homology for every row of a
+        scaled model ordered float32 matrix
+        """
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        probs = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), batch_size):
+            batch = matrix[start:start + batch_size]
+            probs[start:start + len(batch)] = self.booster.inplace_predict(batch)
+        return probs
+
+    def predict(self, df, batch_size=BATCH_SIZE):
+        return self.predict_matrix(self.feature_matrix(df), batch_size)
+
+    def score_frame(self, df, batch_size=BATCH_SIZE, threshold=0.5):
+        """
+        the input rows with prob_pred_1 and prediction
+        """
+        probs = self.predict(df, batch_size)
+        scored_df = df.copy()
+        scored_df['prob_pred_1'] = probs
+        scored_df['prediction'] = (probs > threshold).astype(int)
+        return scored_df
+
+
+if __name__ == "__main__":
+    main()
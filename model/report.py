@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""
+This script summarises the scored probes of a cohort,
+per probe mean, max and spread of the homology
+probability over samples, the fraction of samples
+called above the threshold and how stable that call
+is, the scored tables are read in chunks so the
+cohort never has to fit in memory
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from pipeline.table_io import add_format_arg, iter_table, write_table, CHUNK_ROWS
+
+REPORT_COLUMNS = ['probe', 'n_samples', 'mean_prob', 'max_prob', 'std_prob',
+                  'frac_above', 'stability', 'rank']
+
+
+def main():
+    args = parse_args()
+    run(args.scored_tables,
+        args.outname,
+        args.top,
+        args.threshold,
+        args.all_outname,
+        args.chunksize,
+        args.table_format)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-i', dest='scored_tables', nargs='+',
+                        help="scored tables with probe and prob_pred_1 columns, see inference.py",
+                        required=True)
+    parser.add_argument('-o', dest='outname',
+                        help="report of the top ranked probes",
+                        required=True)
+    parser.add_argument('-k', '--top', dest='top', type=int,
+                        help="number of probes in the report, 0 for all",
+                        default=100)
+    parser.add_argument('--threshold', dest='threshold', type=float,
+                        help="probability above which a sample calls the probe homologous",
+                        default=0.5)
+    parser.add_argument('-a', dest='all_outname',
+                        help="also write the aggregates of every probe here",
+                        default=None)
+    parser.add_argument('--chunksize', dest='chunksize', type=int,
+                        help="rows read at a time",
+                        default=CHUNK_ROWS)
+    add_format_arg(parser)
+    args = parser.parse_args()
+    return args
+
+
+def run(scored_tables,
+        outname,
+        top=100,
+        threshold=0.5,
+        all_outname=None,
+        chunksize=CHUNK_ROWS,
+        table_format='csv'):
+    for scored_table in scored_tables:
+        assert os.path.isfile(scored_table)
+    aggregate = ProbeAggregate(threshold)
+    for scored_table in scored_tables:
+        sep = '\t' if scored_table.endswith('.tsv') else ','
+        for chunk in iter_table(scored_table, chunksize, sep=sep,
+                                columns=['probe', 'prob_pred_1']):
+            aggregate.add(chunk['probe'].values, chunk['prob_pred_1'].values)
+    report_df = aggregate.report()
+    if all_outname:
+        write_table(report_df, all_outname, table_format)
+    write_table(top_probes(report_df, top), outname, table_format)
+
+
+class ProbeAggregate(object):
+    """
+    running count, sum, sum of squares, max and calls
+    above threshold of every probe, each chunk is folded
+    in with bincount over its probe codes
+    """
+
+    def __init__(self, threshold=0.5):
+        self.threshold = threshold
+        self.probes = pd.Index([], dtype=object)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.total = np.zeros(0)
+        self.total_sq = np.zeros(0)
+        self.above = np.zeros(0, dtype=np.int64)
+        self.maximum = np.zeros(0)
+
+    def _codes(self, probes):
+        codes = self.probes.get_indexer(probes)
+        new = codes < 0
+        if new.any():
+            self.probes = self.probes.append(pd.Index(pd.unique(probes[new])))
+            codes[new] = self.probes.get_indexer(probes[new])
+            grow = len(self.probes) - len(self.count)
+            self.count = np.concatenate([self.count, np.zeros(grow, dtype=np.int64)])
+            self.total = np.concatenate([self.total, np.zeros(grow)])
+            self.total_sq = np.concatenate([self.total_sq, np.zeros(grow)])
+            self.above = np.concatenate([self.above, np.zeros(grow, dtype=np.int64)])
+            self.maximum = np.concatenate([self.maximum, np.full(grow, -np.inf)])
+        return codes
+
+    def add(self, probes, probs):
+        probs = np.asarray(probs, dtype=np.float64)
+        keep = ~np.isnan(probs)
+        probes = np.asarray(probes, dtype=object)[keep]
+        probs = probs[keep]
+        if not len(probs):
+            return
+        codes = self._codes(probes)
+        n = len(self.probes)
+        self.count += np.bincount(codes, minlength=n)
+        self.total += np.bincount(codes, weights=probs, minlength=n)
+        self.total_sq += np.bincount(codes, weights=probs * probs, minlength=n)
+        self.above += np.bincount(codes, weights=probs > self.threshold,
+                                  minlength=n).astype(np.int64)
+        chunk_max = pd.Series(probs).groupby(codes).max()
+        rows = chunk_max.index.values
+        self.maximum[rows] = np.maximum(self.maximum[rows], chunk_max.values)
+
+    def report(self):
+        """
+        one row per probe ranked by mean then max probability,
+        stability is the fraction of samples agreeing with
+        the majority call of the probe
+        """
+        count = np.maximum(self.count, 1)
+        mean = self.total / count
+        var = np.maximum(self.total_sq / count - mean * mean, 0)
+        frac_above = self.above / count
+        report_df = pd.DataFrame({'probe': self.probes.values,
+                                  'n_samples': self.count,
+                                  'mean_prob': mean,
+                                  'max_prob': self.maximum,
+                                  'std_prob': np.sqrt(var),
+                                  'frac_above': frac_above,
+                                  'stability': np.maximum(frac_above, 1 - frac_above)})
+        order = np.lexsort((report_df['probe'].values, -report_df['max_prob'].values,
+                            -report_df['mean_prob'].values))
+        report_df = report_df.iloc[order].reset_index(drop=True)
+        report_df['rank'] = np.arange(1, len(report_df) + 1)
+        return report_df[REPORT_COLUMNS]
+
+
+def top_probes(report_df, top=100):
+    if top and top < len(report_df):
+        return report_df.iloc[:top]
+    return report_df
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+
+"""
+This script keeps the homology model resident in a
+local scoring server, concurrent requests are
+gathered over a short window and scored as one batch
+
+POST /score  {"rows": [{feature: value, ...}, ...]}
+             or {"columns": [...], "data": [[...], ...]}
+             returns {"prob_pred_1": [...]}
+GET /stats   request, row, batch and latency counters
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+import asyncio
+import collections
+import http.client
+import json
+import os
+import socket
+import time
+import numpy as np
+import pandas as pd
+from model.inference import (HomologyModel,
+                             DEFAULT_MODEL,
+                             DEFAULT_SCALER,
+                             DEFAULT_COLUMNS,
+                             DEFAULT_MAPPING)
+
+BATCH_WINDOW = 0.005
+MAX_BATCH_ROWS = 65536
+LATENCY_WINDOW = 10000
+MAX_BODY = 1 << 28
+
+
+def main():
+    args = parse_args()
+    model = HomologyModel(args.model_file,
+                          args.scaler_file,
+                          args.columns_file,
+                          args.mapping_file,
+                          args.threads)
+    run(model,
+        args.host,
+        args.port,
+        args.socket_path,
+        args.window / 1000.0,
+        args.max_batch)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', dest='host',
+                        help="address to listen on",
+                        default='127.0.0.1')
+    parser.add_argument('--port', dest='port', type=int,
+                        help="tcp port to listen on",
+                        default=8765)
+    parser.add_argument('-u', dest='socket_path',
+                        help="listen on this unix socket instead of tcp",
+                        default=None)
+    parser.add_argument('-m', dest='model_file',
+                        help="xgboost model joblib",
+                        default=DEFAULT_MODEL)
+    parser.add_argument('-s', dest='scaler_file',
+                        help="fitted MinMaxScaler pickle",
+                        default=DEFAULT_SCALER)
+    parser.add_argument('--columns', dest='columns_file',
+                        help="model column order, one feature per line",
+                        default=DEFAULT_COLUMNS)
+    parser.add_argument('--mapping', dest='mapping_file',
+                        help="feature name mapping, name=alias per line",
+                        default=DEFAULT_MAPPING)
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        help="xgboost prediction threads",
+                        default=1)
+    parser.add_argument('--window', dest='window', type=float,
+                        help="milliseconds to gather requests into one batch",
+                        default=BATCH_WINDOW * 1000)
+    parser.add_argument('--max-batch', dest='max_batch', type=int,
+                        help="rows that close a batch before the window ends",
+                        default=MAX_BATCH_ROWS)
+    args = parser.parse_args()
+    return args
+
+
+def run(model, host='127.0.0.1', port=8765, socket_path=None,
+        window=BATCH_WINDOW, max_batch=MAX_BATCH_ROWS):
+    server = ScoringServer(model, window, max_batch)
+    try:
+        asyncio.run(server.serve(host, port, socket_path))
+    except KeyboardInterrupt:
+        pass
+
+
+def request_frame(payload):
+    """
+    feature rows of a request body as a dataframe
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("request body must be a json object")
+    if 'rows' in payload:
+        rows = payload['rows']
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("rows must be a list of objects")
+        return pd.DataFrame.from_records(rows)
+    if 'columns' in payload and 'data' in payload:
+        columns, data = payload['columns'], payload['data']
+        if not (isinstance(columns, list) and isinstance(data, list)
+                and all(isinstance(row, list) and len(row) == len(columns) for row in data)):
+            raise ValueError("data must be a list of rows as long as columns")
+        return pd.DataFrame(data, columns=columns)
+    raise ValueError("request needs rows or columns and data")
+
+
+def settle(future, result=None, error=None):
+    """
+    answer a request unless it was already answered or
+    its handler was cancelled
+    """
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class ServerStats(object):
+    """
+    counters since start and the latency of the last
+    LATENCY_WINDOW requests in milliseconds
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.rows = 0
+        self.batches = 0
+        self.max_batch_rows = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def add_batch(self, n_rows):
+        self.batches += 1
+        self.max_batch_rows = max(self.max_batch_rows, n_rows)
+
+    def add_request(self, n_rows, seconds):
+        self.requests += 1
+        self.rows += n_rows
+        self.latencies.append(seconds * 1000.0)
+
+    def report(self):
+        uptime = time.monotonic() - self.started
+        latencies = np.asarray(self.latencies)
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        else:
+            p50 = p95 = p99 = 0.0
+        return {'uptime_s': round(uptime, 3),
+                'requests': self.requests,
+                'errors': self.errors,
+                'rows': self.rows,
+                'batches': self.batches,
+                'mean_batch_rows': round(self.rows / self.batches, 2) if self.batches else 0,
+                'max_batch_rows': self.max_batch_rows,
+                'requests_per_s': round(self.requests / uptime, 3) if uptime else 0,
+                'rows_per_s': round(self.rows / uptime, 3) if uptime else 0,
+                'latency_ms_p50': round(float(p50), 3),
+                'latency_ms_p95': round(float(p95), 3),
+                'latency_ms_p99': round(float(p99), 3)}
+
+
+class ScoringServer(object):
+    """
+    http front end over one model, requests wait on a
+    queue until the batch window closes and the batch
+    is scored on a worker thread off the event loop
+    """
+
+    def __init__(self, model, window=BATCH_WINDOW, max_batch=MAX_BATCH_ROWS):
+        self.model = model
+        self.window = window
+        self.max_batch = max_batch
+        self.stats = ServerStats()
+        self.queue = None
+
+    async def serve(self, host='127.0.0.1', port=8765, socket_path=None, ready=None):
+        self.queue = asyncio.Queue()
+        batcher = asyncio.ensure_future(self.batch_loop())
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    async def score(self, df):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((df, future))
+        return await future
+
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            n_rows = len(pending[0][0])
+            deadline = loop.time() + self.window
+            while n_rows < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                n_rows += len(item[0])
+            try:
+                await self.score_batch(pending, n_rows)
+            except Exception as e:
+                # the loop serves every later request, only this batch fails
+                for df, future in pending:
+                    settle(future, error=e)
+
+    async def score_batch(self, pending, n_rows):
+        """
+        one prediction over every queued request, a request
+        that fails on its own is answered with its error and
+        requests whose handler is gone are skipped
+        """
+        loop = asyncio.get_running_loop()
+        matrices = []
+        scored = []
+        for df, future in pending:
+            if future.done():
+                continue
+            try:
+                matrices.append(self.model.feature_matrix(df))
+                scored.append(future)
+            except (ValueError, KeyError, TypeError) as e:
+                settle(future, error=ValueError(str(e)))
+            except Exception as e:
+                settle(future, error=e)
+        if not matrices:
+            return
+        matrix = np.concatenate(matrices) if len(matrices) > 1 else matrices[0]
+        try:
+            probs = await loop.run_in_executor(None, self.model.predict_matrix, matrix)
+        except Exception as e:
+            for future in scored:
+                settle(future, error=e)
+            return
+        self.stats.add_batch(len(matrix))
+        offset = 0
+        for rows, future in zip(matrices, scored):
+            settle(future, probs[offset:offset + len(rows)])
+            offset += len(rows)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = await self.dispatch(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        if method == 'GET' and path == '/stats':
+            return 200, self.stats.report()
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'ok'}
+        if method != 'POST' or path != '/score':
+            return 404, {'error': "unknown endpoint {0} {1}".format(method, path)}
+        started = time.monotonic()
+        try:
+            df = request_frame(json.loads(body))
+            probs = await self.score(df) if len(df) else np.zeros(0, dtype=np.float32)
+        except (ValueError, TypeError, KeyError) as e:
+            self.stats.errors += 1
+            return 400, {'error': str(e)}
+        except Exception as e:
+            self.stats.errors += 1
+            return 500, {'error': "{0}: {1}".format(type(e).__name__, e)}
+        self.stats.add_request(len(df), time.monotonic() - started)
+        return 200, {'prob_pred_1': probs.tolist()}
+
+
+async def read_request(reader):
+    """
+    method, path, lower case headers and body of one
+    http/1.1 request, None once the client is gone
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, value = line.decode('latin-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+
+async def write_response(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload).encode()
+    head = ("HTTP/1.1 {0} {1}\r\n"
+            "Content-Type: application/json\r\n"
+            "Content-Length: {2}\r\n"
+            "Connection: {3}\r\n\r\n").format(status,
+                                              http.client.responses.get(status, ''),
+                                              len(body),
+                                              'keep-alive' if keep_alive else 'close')
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ScoringClient(object):
+    """
+    blocking client of a scoring server over tcp or a
+    unix socket, keeps one connection open
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, socket_path=None, timeout=60):
+        if socket_path:
+            self.connection = UnixHTTPConnection(socket_path, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _request(self, method, path, payload=None):
+        body = json.dumps(payload) if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body else {}
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise ValueError(result.get('error', response.reason))
+        return result
+
+    def score(self, df):
+        """
+        prob_pred_1 of every row of a feature dataframe
+        """
+        payload = {'columns': [str(c) for c in df.columns],
+                   'data': df.astype(object).where(df.notna(), None).values.tolist()}
+        return np.asarray(self._request('POST', '/score', payload)['prob_pred_1'])
+
+    def stats(self):
+        return self._request('GET', '/stats')
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    main()
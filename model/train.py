@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+
+"""
+This script trains the homology model, a search over
+the xgboost hyperparameters of the notebook runs its
+trials in parallel worker processes, every trial stops
+early on the validation split and trials doing worse
+than the median of finished trials are pruned, trials
+are kept in a sqlite store so an interrupted search
+resumes where it stopped, the best trial is refit and
+saved with its scaler
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+import json
+import math
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import joblib
+import numpy as np
+import xgboost as xgb
+from sklearn import preprocessing
+from sklearn.model_selection import train_test_split
+from xgboost import XGBClassifier
+from bed.track_cache import file_digest
+from model.inference import DEFAULT_COLUMNS, DEFAULT_MAPPING, read_aliases, read_list, raw_feature_matrix
+from pipeline.table_io import read_table
+
+N_TRIALS = 150
+EARLY_STOPPING_ROUNDS = 10
+# early stopping rounds are given at this eta and scaled to the trial eta
+REFERENCE_ETA = 0.3
+PRUNE_WARMUP = 50
+PRUNE_INTERVAL = 25
+PRUNE_STARTUP = 5
+FIXED_PARAMS = {'objective': 'binary:logistic',
+                'tree_method': 'hist',
+                'eval_metric': ['error', 'logloss']}
+# early stopping and pruning follow the last eval metric
+STOP_METRIC = 'logloss'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS studies (
+    study_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    settings TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS trials (
+    study_id INTEGER NOT NULL,
+    number INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    params TEXT NOT NULL,
+    value REAL,
+    best_iteration INTEGER,
+    seconds REAL,
+    PRIMARY KEY (study_id, number)
+);
+CREATE TABLE IF NOT EXISTS trial_steps (
+    study_id INTEGER NOT NULL,
+    number INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (study_id, number, step)
+) WITHOUT ROWID;
+"""
+
+
+def main():
+    args = parse_args()
+    run(args.input_table,
+        args.outname,
+        args.scaler_outname,
+        args.trials_db,
+        args.study,
+        args.n_trials,
+        args.workers,
+        args.threads,
+        args.label,
+        args.columns_file,
+        args.mapping_file,
+        args.seed,
+        args.early_stopping_rounds)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-i', dest='input_table',
+                        help="labelled training table",
+                        required=True)
+    parser.add_argument('-o', dest='outname',
+                        help="trained model joblib",
+                        required=True)
+    parser.add_argument('-s', dest='scaler_outname',
+                        help="fitted MinMaxScaler pickle",
+                        required=True)
+    parser.add_argument('-d', dest='trials_db',
+                        help="sqlite trial store, a search over the same table content "
+                             "resumes and runs its running and failed trials again, "
+                             "default <model>.trials.db",
+                        default=None)
+    parser.add_argument('--study', dest='study',
+                        help="name of the search in the trial store",
+                        default='xgb')
+    parser.add_argument('-n', dest='n_trials', type=int,
+                        help="number of trials of the search",
+                        default=N_TRIALS)
+    parser.add_argument('-p', dest='workers', type=int,
+                        help="trials run in parallel",
+                        default=1)
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        help="xgboost threads shared by the parallel trials",
+                        default=1)
+    parser.add_argument('-l', dest='label',
+                        help="label column",
+                        default='Class')
+    parser.add_argument('--columns', dest='columns_file',
+                        help="features of the model, one per line",
+                        default=DEFAULT_COLUMNS)
+    parser.add_argument('--mapping', dest='mapping_file',
+                        help="feature name mapping, name=alias per line",
+                        default=DEFAULT_MAPPING)
+    parser.add_argument('--seed', dest='seed', type=int,
+                        help="seed of the splits and the sampled trials",
+                        default=42)
+    parser.add_argument('--early-stopping', dest='early_stopping_rounds', type=int,
+                        help="rounds without validation logloss improvement before a trial "
+                             "stops at eta {0}, scaled by {0} / eta".format(REFERENCE_ETA),
+                        default=EARLY_STOPPING_ROUNDS)
+    args = parser.parse_args()
+    return args
+
+
+def run(input_table,
+        outname,
+        scaler_outname,
+        trials_db=None,
+        study='xgb',
+        n_trials=N_TRIALS,
+        workers=1,
+        threads=1,
+        label='Class',
+        columns_file=DEFAULT_COLUMNS,
+        mapping_file=DEFAULT_MAPPING,
+        seed=42,
+        early_stopping_rounds=EARLY_STOPPING_ROUNDS):
+    assert os.path.isfile(input_table)
+    sep = '\t' if input_table.endswith('.tsv') else ','
+    df = read_table(input_table, sep=sep)
+    columns = read_list(columns_file)
+    matrix = raw_feature_matrix(df, columns, read_aliases(mapping_file))
+    scaler, splits = preprocess_data(matrix, df[label].values.astype(int), random_state=seed)
+    if trials_db is None:
+        trials_db = os.path.splitext(outname)[0] + '.trials.db'
+    # the table digest is remembered next to the trial store
+    digest_dir = os.path.splitext(trials_db)[0] + '.digests'
+    settings = {'input_sha256': file_digest(input_table, digest_dir), 'columns': columns,
+                'label': label, 'seed': seed, 'early_stopping_rounds': early_stopping_rounds,
+                'metric': STOP_METRIC}
+    best = search(splits, trials_db, study, settings, n_trials, workers, threads)
+    print("best trial {0} validation {1} {2:.4f} at {3} rounds".format(
+        best['number'], STOP_METRIC, best['value'], best['best_iteration'] + 1))
+    model = fit_best(splits, best, threads, seed)
+    X_train, X_val, X_test, y_train, y_val, y_test = splits
+    print("validation accuracy {0:.4f}".format(np.mean(model.predict(X_val) == y_val)))
+    print("test accuracy {0:.4f}".format(np.mean(model.predict(X_test) == y_test)))
+    joblib.dump(model, outname)
+    joblib.dump(scaler, scaler_outname)
+
+
+def preprocess_data(matrix, labels, test_size=0.1, val_size=0.1, random_state=42):
+    """
+    MinMax scaled train, validation and test splits as in
+    the notebook
+    """
+    scaler = preprocessing.MinMaxScaler()
+    X = scaler.fit_transform(matrix).astype(np.float32)
+    X_train, X_test, y_train, y_test = train_test_split(X, labels, test_size=test_size,
+                                                        random_state=random_state)
+    X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, test_size=val_size,
+                                                      random_state=random_state)
+    return scaler, (X_train, X_val, X_test, y_train, y_val, y_test)
+
+
+def quniform(rng, low, high, q):
+    return round(round(rng.uniform(low, high) / q) * q, 10)
+
+
+def sample_params(seed, number):
+    """
+    parameters of trial number, drawn from the notebook
+    search space with a generator seeded by the trial so a
+    resumed search draws the same trials
+    """
+    rng = np.random.default_rng([seed, number])
+    return {'max_depth': int(rng.integers(5, 15)),
+            'n_estimators': int(rng.choice(np.arange(100, 10000, 10))),
+            'colsample_bytree': quniform(rng, 0.1, 1.0, 0.1),
+            'min_child_weight': int(rng.choice(np.arange(250, 350, 10))),
+            'subsample': quniform(rng, 0.7, 0.9, 0.1),
+            'learning_rate': quniform(rng, 0.01, 0.3, 0.01),
+            'gamma': quniform(rng, 0, 0.5, 0.05),
+            'reg_alpha': float(np.exp(rng.uniform(np.log(1e-10), np.log(1)))),
+            'reg_lambda': float(np.exp(rng.uniform(np.log(1e-10), np.log(1))))}
+
+
+def patience(learning_rate, early_stopping_rounds=EARLY_STOPPING_ROUNDS):
+    """
+    early stopping rounds of a trial, a smaller eta needs
+    more rounds to improve the validation logloss
+    """
+    return max(early_stopping_rounds,
+               int(math.ceil(early_stopping_rounds * REFERENCE_ETA / learning_rate)))
+
+
+def booster_params(params, threads, seed):
+    """
+    xgb.train parameters of sampled XGBClassifier ones
+    """
+    booster = dict(FIXED_PARAMS)
+    booster.update({'max_depth': params['max_depth'],
+                    'colsample_bytree': params['colsample_bytree'],
+                    'min_child_weight': params['min_child_weight'],
+                    'subsample': params['subsample'],
+                    'eta': params['learning_rate'],
+                    'gamma': params['gamma'],
+                    'alpha': params['reg_alpha'],
+                    'lambda': params['reg_lambda'],
+                    'nthread': threads,
+                    'seed': seed})
+    return booster
+
+
+class TrialStore(object):
+    """
+    sqlite store of the trials of every study, a trial is
+    running, complete, pruned or failed, and its best
+    validation logloss so far is kept at every pruning step
+    """
+
+    def __init__(self, db_file):
+        self.conn = sqlite3.connect(db_file, timeout=600)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def study_id(self, name, settings):
+        """
+        id of the named study, a study is only resumed with
+        the settings it was started with, the input table
+        is matched by its sha256 not its path
+        """
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO studies (name, settings) VALUES (?, ?)',
+                              (name, json.dumps(settings, sort_keys=True)))
+        study_id, stored = self.conn.execute('SELECT study_id, settings FROM studies WHERE name = ?',
+                                             (name,)).fetchone()
+        if json.loads(stored) != json.loads(json.dumps(settings)):
+            raise ValueError("study {0} was started with other settings, "
+                             "use another --study or trial store".format(name))
+        return study_id
+
+    def reset_unfinished(self, study_id):
+        """
+        trials left running by an interrupted search and
+        trials that failed, often a killed worker, are run
+        again
+        """
+        states = ('running', 'failed')
+        with self.conn:
+            self.conn.execute('DELETE FROM trial_steps WHERE study_id = ? AND number IN '
+                              '(SELECT number FROM trials WHERE study_id = ? AND state IN (?, ?))',
+                              (study_id, study_id) + states)
+            self.conn.execute('DELETE FROM trials WHERE study_id = ? AND state IN (?, ?)',
+                              (study_id,) + states)
+
+    def finished(self, study_id):
+        return {row[0] for row in self.conn.execute(
+            'SELECT number FROM trials WHERE study_id = ?', (study_id,))}
+
+    def start(self, study_id, number, params):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO trials (study_id, number, state, params) '
+                              'VALUES (?, ?, ?, ?)',
+                              (study_id, number, 'running', json.dumps(params)))
+
+    def finish(self, study_id, number, state, value, best_iteration, seconds):
+        with self.conn:
+            self.conn.execute('UPDATE trials SET state = ?, value = ?, best_iteration = ?, '
+                              'seconds = ? WHERE study_id = ? AND number = ?',
+                              (state, value, best_iteration, seconds, study_id, number))
+
+    def report(self, study_id, number, step, value):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO trial_steps VALUES (?, ?, ?, ?)',
+                              (study_id, number, step, value))
+
+    def step_values(self, study_id, step):
+        """
+        validation logloss at step of every complete trial,
+        its final value when it stopped before the step
+        """
+        return [row[0] for row in self.conn.execute(
+            'SELECT COALESCE(s.value, t.value) FROM trials t LEFT JOIN trial_steps s '
+            'ON s.study_id = t.study_id AND s.number = t.number AND s.step = ? '
+            'WHERE t.study_id = ? AND t.state = ?', (step, study_id, 'complete'))]
+
+    def best(self, study_id):
+        row = self.conn.execute('SELECT number, params, value, best_iteration FROM trials '
+                                'WHERE study_id = ? AND state = ? ORDER BY value, number LIMIT 1',
+                                (study_id, 'complete')).fetchone()
+        if row is None:
+            raise ValueError("no complete trial in the study")
+        return {'number': row[0], 'params': json.loads(row[1]),
+                'value': row[2], 'best_iteration': row[3]}
+
+
+class MedianPruner(xgb.callback.TrainingCallback):
+    """
+    every PRUNE_INTERVAL rounds after PRUNE_WARMUP the best
+    validation logloss so far is reported, and training stops
+    as pruned when it is worse than the median of complete
+    trials at that round
+    """
+
+    def __init__(self, store, study_id, number):
+        super().__init__()
+        self.store = store
+        self.study_id = study_id
+        self.number = number
+        self.pruned = False
+
+    def after_iteration(self, model, epoch, evals_log):
+        step = epoch + 1
+        if step < PRUNE_WARMUP or step % PRUNE_INTERVAL:
+            return False
+        value = min(evals_log['validation'][STOP_METRIC])
+        self.store.report(self.study_id, self.number, step, value)
+        others = self.store.step_values(self.study_id, step)
+        if len(others) >= PRUNE_STARTUP and value > np.median(others):
+            self.pruned = True
+        return self.pruned
+
+
+_worker = {}
+
+
+def _init_worker(splits, trials_db, study_id, threads, seed, early_stopping_rounds):
+    X_train, X_val, X_test, y_train, y_val, y_test = splits
+    dtrain = xgb.QuantileDMatrix(X_train, y_train, nthread=threads)
+    dval = xgb.QuantileDMatrix(X_val, y_val, ref=dtrain, nthread=threads)
+    _worker.update(dtrain=dtrain, dval=dval, store=TrialStore(trials_db),
+                   study_id=study_id, threads=threads, seed=seed,
+                   early_stopping_rounds=early_stopping_rounds)
+
+
+def run_trial(number, params):
+    """
+    train one trial with early stopping on the validation
+    split, returns its state, best validation logloss,
+    best iteration and the validation error there
+    """
+    started = time.time()
+    pruner = MedianPruner(_worker['store'], _worker['study_id'], number)
+    evals_result = {}
+    booster = xgb.train(booster_params(params, _worker['threads'], _worker['seed']),
+                        _worker['dtrain'],
+                        num_boost_round=params['n_estimators'],
+                        evals=[(_worker['dval'], 'validation')],
+                        early_stopping_rounds=patience(params['learning_rate'],
+                                                       _worker['early_stopping_rounds']),
+                        evals_result=evals_result,
+                        callbacks=[pruner],
+                        verbose_eval=False)
+    state = 'pruned' if pruner.pruned else 'complete'
+    best_iteration = int(booster.best_iteration)
+    error = evals_result['validation']['error'][best_iteration]
+    return (number, state, float(booster.best_score), best_iteration, float(error),
+            time.time() - started)
+
+
+def search(splits, trials_db, study, settings, n_trials=N_TRIALS, workers=1, threads=1):
+    """
+    run the trials of the study missing from the store,
+    workers at a time with threads // workers xgboost
+    threads each, and return the best complete trial
+    """
+    store = TrialStore(trials_db)
+    study_id = store.study_id(study, settings)
+    store.reset_unfinished(study_id)
+    todo = [n for n in range(n_trials) if n not in store.finished(study_id)]
+    seed = settings['seed']
+    trial_threads = max(1, threads // max(workers, 1))
+    initargs = (splits, trials_db, study_id, trial_threads, seed,
+                settings['early_stopping_rounds'])
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=initargs) as executor:
+        pending = {}
+        while todo or pending:
+            while todo and len(pending) < workers:
+                number = todo.pop(0)
+                params = sample_params(seed, number)
+                store.start(study_id, number, params)
+                pending[executor.submit(run_trial, number, params)] = number
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                number = pending.pop(future)
+                try:
+                    number, state, value, best_iteration, error, seconds = future.result()
+                except Exception as error:
+                    print("trial {0} failed {1}".format(number, error))
+                    store.finish(study_id, number, 'failed', None, None, None)
+                    continue
+                store.finish(study_id, number, state, value, best_iteration, seconds)
+                print("trial {0} {1} validation {2} {3:.4f} error {4:.4f} rounds {5} {6:.1f}s".format(
+                    number, state, STOP_METRIC, value, error, best_iteration + 1, seconds))
+    best = store.best(study_id)
+    store.close()
+    return best
+
+
+def fit_best(splits, best, threads=1, seed=42):
+    """
+    XGBClassifier of the best trial with the rounds early
+    stopping kept, fit on the training split
+    """
+    X_train, X_val, X_test, y_train, y_val, y_test = splits
+    params = dict(best['params'])
+    params['n_estimators'] = best['best_iteration'] + 1
+    model = XGBClassifier(n_jobs=threads, random_state=seed, **FIXED_PARAMS, **params)
+    model.fit(X_train, y_train)
+    return model
+
+
+if __name__ == "__main__":
+    main()
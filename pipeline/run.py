@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+
+"""
+clinray run, the extraction, annotation, merge and
+scoring steps as one dag of stages, a stage reruns
+only when the hash of its inputs and parameters
+changed since its last successful run
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from bam import extract_bam_summary
+from bam.extract_bam_summary import (ScanConfig,
+                                     DEFAULT_TAGS,
+                                     parse_tags,
+                                     add_sampling_args,
+                                     add_reference_args,
+                                     set_ref_cache,
+                                     skip_flags)
+from bam.extract_bam_batch import read_manifest as read_sample_manifest
+from bam.feature_store import FeatureStore
+from bam.merge_chuncks import merge_chunks
+from bed.annotate_tracks import read_manifest as read_track_manifest
+from bed.bed_reader import add_chr_prefix, read_bed_frame
+from bed.combine_bed_annotation import combine_tracks
+from bed.overlap import track_overlap
+from bed.probe_store import ProbeStore, DEFAULT_BUILD
+from bed.track_cache import track_index
+from model import report
+from model.inference import (HomologyModel,
+                             DEFAULT_MODEL,
+                             DEFAULT_SCALER,
+                             DEFAULT_COLUMNS,
+                             DEFAULT_MAPPING)
+from pipeline.table_io import add_format_arg, table_suffix, read_table, write_table
+
+STATE_DIR = '.clinray'
+# alignment files are fingerprinted by size and mtime, hashing
+# a whole bam costs more than extracting the probes from it
+STAT_SUFFIXES = ('.bam', '.cram')
+
+Stage = collections.namedtuple('Stage', ['name', 'func', 'kwargs', 'inputs', 'outputs', 'deps'])
+
+
+def main():
+    args = parse_args()
+    set_ref_cache(args.ref_cache)
+    config = ScanConfig(tags=args.tags,
+                        max_reads=args.max_reads,
+                        skip_flags=skip_flags(args.skip),
+                        reference=args.reference)
+    run(args.manifest,
+        args.bed_file,
+        args.out_dir,
+        args.tracks,
+        args.processes,
+        args.threads,
+        config,
+        args.table_format,
+        args.track_cache,
+        args.probe_store,
+        args.build,
+        args.score,
+        args.model_file,
+        args.scaler_file,
+        args.feature_store,
+        args.dry_run)
+
+
+def parse_args():
+    """
+    parsing arguments
+    """
+    parser = argparse.ArgumentParser(prog='clinray run', description=__doc__)
+    parser.add_argument('-m', dest='manifest',
+                        help="tab separated manifest of sample name and bam or cram path",
+                        required=True)
+    parser.add_argument('-b', dest='bed_file',
+                        help="probe bed file",
+                        required=True)
+    parser.add_argument('-o', dest='out_dir',
+                        help="out dir, holds the stage outputs and their cache state",
+                        required=True)
+    parser.add_argument('-a', dest='tracks',
+                        help="tab separated manifest of annotation name and annotation bed track",
+                        default=None)
+    parser.add_argument('-p', '--processes', dest='processes', type=int,
+                        help="number of stages run in parallel",
+                        default=1)
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        help="bgzf decompression and prediction threads per stage",
+                        default=1)
+    parser.add_argument('--tags', dest='tags', type=parse_tags,
+                        help="comma separated aux tags to extract",
+                        default=DEFAULT_TAGS)
+    add_sampling_args(parser)
+    add_reference_args(parser)
+    parser.add_argument('-c', dest='track_cache',
+                        help="compiled track cache directory, see track_cache.py",
+                        default=None)
+    parser.add_argument('-d', dest='probe_store',
+                        help="sqlite probe annotation store, see probe_store.py",
+                        default=None)
+    parser.add_argument('--build', dest='build',
+                        help="genome build of the probes and tracks in the probe store",
+                        default=DEFAULT_BUILD)
+    parser.add_argument('--score', dest='score', action='store_true',
+                        help="score every sample with the homology model, needs -a")
+    parser.add_argument('--model-file', dest='model_file',
+                        help="xgboost model joblib",
+                        default=DEFAULT_MODEL)
+    parser.add_argument('--scaler-file', dest='scaler_file',
+                        help="fitted MinMaxScaler pickle",
+                        default=DEFAULT_SCALER)
+    parser.add_argument('-f', dest='feature_store',
+                        help="also add every sample to this cohort feature store under its "
+                             "manifest name, a name already added from another run "
+                             "fails, see feature_store.py",
+                        default=None)
+    parser.add_argument('-n', '--dry-run', dest='dry_run', action='store_true',
+                        help="list the stages that would run without running them")
+    add_format_arg(parser)
+    args = parser.parse_args()
+    return args
+
+
+def run(manifest,
+        bed_file,
+        out_dir,
+        tracks=None,
+        processes=1,
+        threads=1,
+        config=ScanConfig(),
+        table_format='csv',
+        track_cache=None,
+        probe_store=None,
+        build=DEFAULT_BUILD,
+        score=False,
+        model_file=DEFAULT_MODEL,
+        scaler_file=DEFAULT_SCALER,
+        feature_store=None,
+        dry_run=False):
+    assert os.path.isfile(bed_file)
+    if score and not tracks:
+        raise ValueError("scoring needs the annotation tracks, pass -a")
+    samples = read_sample_manifest(manifest)
+    track_list = read_track_manifest(tracks) if tracks else []
+    stages = build_stages(samples, bed_file, out_dir, track_list, threads,
+                          config, table_format, track_cache, probe_store,
+                          build, score, model_file, scaler_file,
+                          feature_store)
+    logger = configure_logger()
+    return run_stages(stages, out_dir, processes, logger, dry_run)
+
+
+def configure_logger():
+    """
+    setting up logging
+    """
+    logger = logging.getLogger('Clinray_Run')
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s\t%(message)s"))
+        logger.addHandler(handler)
+    return logger
+
+
+def build_stages(samples,
+                 bed_file,
+                 out_dir,
+                 tracks=(),
+                 threads=1,
+                 config=ScanConfig(),
+                 table_format='csv',
+                 track_cache=None,
+                 probe_store=None,
+                 build=DEFAULT_BUILD,
+                 score=False,
+                 model_file=DEFAULT_MODEL,
+                 scaler_file=DEFAULT_SCALER,
+                 feature_store=None):
+    """
+    one extract stage per sample and one annotate stage
+    per track, the merge, combine and score stages wait
+    on the stages whose outputs they read
+    """
+    suffix = table_suffix(table_format)
+    tsv_suffix = table_suffix(table_format, '\t')
+    metrics_dir = os.path.join(out_dir, 'metrics')
+    stages = []
+    metrics_files = {}
+    reference = [config.reference] if config.reference else []
+    for sample_name, bam_file in samples:
+        outfile = os.path.join(metrics_dir, sample_name + '.metrics' + suffix)
+        metrics_files[sample_name] = outfile
+        stages.append(Stage('extract:' + sample_name, extract_stage,
+                            dict(bam_file=bam_file, bed_file=bed_file,
+                                 sample_name=sample_name, out_dir=metrics_dir,
+                                 threads=threads, config=config._asdict(),
+                                 table_format=table_format),
+                            [bam_file, bed_file] + reference, [outfile], []))
+        if feature_store:
+            stages.append(Stage('store:' + sample_name, store_stage,
+                                dict(metrics_file=outfile, sample_name=sample_name,
+                                     store_dir=feature_store),
+                                [outfile], [], ['extract:' + sample_name]))
+    cohort_file = os.path.join(out_dir, 'cohort.metrics' + suffix)
+    stages.append(Stage('merge:metrics', merge_stage,
+                        dict(all_files=list(metrics_files.values()),
+                             outfile=cohort_file, table_format=table_format),
+                        list(metrics_files.values()), [cohort_file],
+                        ['extract:' + name for name, _ in samples]))
+    if not tracks:
+        return stages
+    track_files = []
+    for anno_name, anno_bed in tracks:
+        outfile = os.path.join(out_dir, 'annotation', anno_name + '.PO' + tsv_suffix)
+        track_files.append(outfile)
+        stages.append(Stage('annotate:' + anno_name, annotate_stage,
+                            dict(bed_file=bed_file, anno_bed=anno_bed,
+                                 anno_name=anno_name, outfile=outfile,
+                                 track_cache=track_cache, probe_store=probe_store,
+                                 build=build, table_format=table_format),
+                            [bed_file, anno_bed], [outfile], []))
+    annotation_file = os.path.join(out_dir, 'probes.annotation' + tsv_suffix)
+    stages.append(Stage('combine:annotation', combine_stage,
+                        dict(all_files=track_files, bed_file=bed_file,
+                             outfile=annotation_file, table_format=table_format),
+                        track_files + [bed_file], [annotation_file],
+                        ['annotate:' + name for name, _ in tracks]))
+    if not score:
+        return stages
+    scored_files = []
+    for sample_name, _ in samples:
+        outfile = os.path.join(out_dir, 'scores', sample_name + '.scored' + suffix)
+        scored_files.append(outfile)
+        stages.append(Stage('score:' + sample_name, score_stage,
+                            dict(metrics_file=metrics_files[sample_name],
+                                 annotation_file=annotation_file, outfile=outfile,
+                                 model_file=model_file, scaler_file=scaler_file,
+                                 threads=threads, table_format=table_format),
+                            [metrics_files[sample_name], annotation_file, model_file,
+                             scaler_file, DEFAULT_COLUMNS, DEFAULT_MAPPING],
+                            [outfile], ['extract:' + sample_name, 'combine:annotation']))
+    scored_cohort = os.path.join(out_dir, 'cohort.scored' + suffix)
+    stages.append(Stage('merge:scores', merge_stage,
+                        dict(all_files=scored_files, outfile=scored_cohort,
+                             table_format=table_format),
+                        scored_files, [scored_cohort],
+                        ['score:' + name for name, _ in samples]))
+    report_file = os.path.join(out_dir, 'probes.report' + suffix)
+    aggregate_file = os.path.join(out_dir, 'probes.aggregate' + suffix)
+    stages.append(Stage('report:probes', report.run,
+                        dict(scored_tables=scored_files, outname=report_file,
+                             all_outname=aggregate_file, table_format=table_format),
+                        scored_files, [report_file, aggregate_file],
+                        ['score:' + name for name, _ in samples]))
+    return stages
+
+
+def extract_stage(bam_file, bed_file, sample_name, out_dir, threads, config,
+                  table_format='csv'):
+    extract_bam_summary.run(bam_file, bed_file, sample_name, out_dir, 1,
+                            threads, ScanConfig(**config), table_format)
+
+
+def annotate_stage(bed_file, anno_bed, anno_name, outfile, track_cache=None,
+                   probe_store=None, build=DEFAULT_BUILD, table_format='csv'):
+    """
+    .PO and .RPO of the probes overlapping one track,
+    written with a header even when nothing overlaps
+    """
+    querry_df = read_bed_frame(bed_file, "querry")
+    load_index = lambda: track_index(anno_bed, anno_name, track_cache)
+    if probe_store:
+        store = ProbeStore(probe_store, build)
+        out_df = store.track_overlap(querry_df, anno_bed, anno_name, load_index)
+        store.close()
+    else:
+        out_df = track_overlap(querry_df, load_index(), anno_name)
+    write_table(out_df, outfile, table_format, sep='\t')
+
+
+def store_stage(metrics_file, sample_name, store_dir):
+    FeatureStore(store_dir).add_table(metrics_file, sample_name)
+
+
+def combine_stage(all_files, bed_file, outfile, table_format='csv'):
+    combine_tracks(all_files, bed_file, outfile, 1, table_format)
+
+
+def merge_stage(all_files, outfile, table_format='csv'):
+    merge_chunks(all_files, outfile, table_format)
+
+
+def probe_key(chrom, start, end):
+    return add_chr_prefix(chrom.astype(str)) + '_' + start.astype(str) + '_' + end.astype(str)
+
+
+def probe_features(metrics_df, annotation_df):
+    """
+    per sample metrics with the annotation of their probe,
+    probes are named chrom_start_end as in the metrics,
+    with the raw bed chrom, and matched to the annotation
+    with chr prefixed chroms on both sides
+    """
+    annotation_df = annotation_df.copy()
+    annotation_df['_key'] = probe_key(annotation_df['chrom'], annotation_df['start'],
+                                      annotation_df['end'])
+    annotation_df = annotation_df.drop_duplicates('_key')
+    parts = metrics_df['probe'].astype(str).str.rsplit('_', n=2, expand=True)
+    metrics_df = metrics_df.assign(_key=probe_key(parts[0], parts[1], parts[2]))
+    features_df = metrics_df.merge(annotation_df, on='_key', how='left', indicator=True)
+    matched = (features_df.pop('_merge') == 'both').sum()
+    features_df = features_df.drop(columns='_key')
+    if len(features_df) and not matched:
+        raise ValueError("no probe of the metrics is in the annotation table")
+    if matched < len(features_df):
+        logging.getLogger('Clinray_Run').warning(
+            "{0} of {1} probes have no annotation".format(len(features_df) - matched,
+                                                         len(features_df)))
+    return features_df
+
+
+def score_stage(metrics_file, annotation_file, outfile, model_file=DEFAULT_MODEL,
+                scaler_file=DEFAULT_SCALER, threads=1, table_format='csv'):
+    features_df = probe_features(read_table(metrics_file),
+                                 read_table(annotation_file, sep='\t'))
+    model = HomologyModel(model_file, scaler_file, threads=threads)
+    write_table(model.score_frame(features_df), outfile, table_format)
+
+
+class StageState(object):
+    """
+    fingerprints of input files and the key of the last
+    successful run of every stage, kept under out_dir
+    """
+
+    def __init__(self, out_dir):
+        self.state_dir = os.path.join(out_dir, STATE_DIR)
+        os.makedirs(os.path.join(self.state_dir, 'stages'), exist_ok=True)
+        self.digest_file = os.path.join(self.state_dir, 'digests.json')
+        self.digests = {}
+        if os.path.isfile(self.digest_file):
+            with open(self.digest_file) as fh:
+                self.digests = json.load(fh)
+
+    def fingerprint(self, filename):
+        """
+        sha256 of a file, remembered against its size and
+        mtime, alignment files use the size and mtime
+        """
+        if not os.path.isfile(filename):
+            return None
+        stat = os.stat(filename)
+        if filename.endswith(STAT_SUFFIXES):
+            return 'stat:{0}:{1}'.format(stat.st_size, stat.st_mtime_ns)
+        source = os.path.abspath(filename)
+        known = self.digests.get(source)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        sha = hashlib.sha256()
+        with open(filename, 'rb') as fh:
+            for block in iter(lambda: fh.read(1 << 20), b''):
+                sha.update(block)
+        self.digests[source] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+        return self.digests[source][2]
+
+    def stage_key(self, stage):
+        value = {'stage': stage.name,
+                 'func': stage.func.__module__ + '.' + stage.func.__name__,
+                 'kwargs': stage.kwargs,
+                 'inputs': [[f, self.fingerprint(f)] for f in stage.inputs]}
+        return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _stamp(self, stage):
+        return os.path.join(self.state_dir, 'stages', stage.name.replace(os.sep, '_') + '.json')
+
+    def is_fresh(self, stage, key):
+        stamp = self._stamp(stage)
+        if not os.path.isfile(stamp):
+            return False
+        with open(stamp) as fh:
+            known = json.load(fh)
+        return known['key'] == key and all(os.path.isfile(f) for f in stage.outputs)
+
+    def record(self, stage, key):
+        _write_json(self._stamp(stage), {'key': key, 'outputs': stage.outputs})
+
+    def save(self):
+        _write_json(self.digest_file, self.digests)
+
+
+def _write_json(filename, value):
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(filename))
+    with os.fdopen(fd, 'w') as fout:
+        json.dump(value, fout)
+    os.replace(tmp_name, filename)
+
+
+def run_stages(stages, out_dir, processes=1, logger=None, dry_run=False):
+    """
+    run every stale stage once its dependencies are done,
+    ready stages share a process pool, returns the names
+    of the stages that ran (or would run on a dry run)
+    """
+    logger = logger or configure_logger()
+    state = StageState(out_dir)
+    pending = list(stages)
+    names = set(stage.name for stage in stages)
+    for stage in stages:
+        unknown = [d for d in stage.deps if d not in names]
+        if unknown:
+            raise ValueError("stage {0} depends on unknown stages {1}".format(stage.name, unknown))
+    done = set()
+    stale = []
+    running = {}
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            while pending or running:
+                ready = [s for s in pending if all(d in done for d in s.deps)]
+                for stage in ready:
+                    pending.remove(stage)
+                    if dry_run and any(d in stale for d in stage.deps):
+                        stale.append(stage.name)
+                        done.add(stage.name)
+                        logger.info("stale\t{0}".format(stage.name))
+                        continue
+                    key = state.stage_key(stage)
+                    if state.is_fresh(stage, key):
+                        done.add(stage.name)
+                        logger.info("cached\t{0}".format(stage.name))
+                        continue
+                    stale.append(stage.name)
+                    if dry_run:
+                        done.add(stage.name)
+                        logger.info("stale\t{0}".format(stage.name))
+                        continue
+                    for outfile in stage.outputs:
+                        os.makedirs(os.path.dirname(outfile) or '.', exist_ok=True)
+                    logger.info("run\t{0}".format(stage.name))
+                    running[executor.submit(stage.func, **stage.kwargs)] = (stage, key)
+                if not running:
+                    if pending and not ready:
+                        raise ValueError("stages {0} can not run".format([s.name for s in pending]))
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, key = running.pop(future)
+                    future.result()
+                    state.record(stage, key)
+                    done.add(stage.name)
+                    logger.info("done\t{0}".format(stage.name))
+    finally:
+        state.save()
+    return stale
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+"""
+Reading and writing of the intermediate tables
+handed between stages, as csv/tsv text or as
+typed columnar parquet or feather (arrow ipc)
+
+__author__ = "Rohan Gnanaolivu"
+__github__ = "ADO repo"
+"""
+
+import numpy as np
+import pandas as pd
+
+FORMATS = ('csv', 'parquet', 'feather')
+SUFFIXES = {'parquet': '.parquet',
+            'feather': '.feather'}
+POSITION_COLUMNS = ('start', 'end', 'length')
+INT32_MAX = np.iinfo(np.int32).max
+CHUNK_ROWS = 1000000
+NUMERIC_OBJECTS = ('mixed-integer', 'mixed-integer-float', 'integer', 'boolean')
+
+
+def add_format_arg(parser):
+    parser.add_argument('--format', dest='table_format', choices=FORMATS,
+                        help="format of the written tables, csv keeps the text tables",
+                        default='csv')
+
+
+def _arrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.feather
+    except ImportError:
+        raise ImportError("parquet and feather tables need pyarrow, pip install pyarrow")
+    return pyarrow
+
+
+def table_suffix(table_format, sep=','):
+    if table_format == 'csv':
+        return '.tsv' if sep == '\t' else '.csv'
+    return SUFFIXES[table_format]
+
+
+def table_format_of(filename):
+    for table_format, suffix in SUFFIXES.items():
+        if filename.endswith(suffix):
+            return table_format
+    return 'csv'
+
+
+def typed_frame(df):
+    """
+    chrom as a category, positions as int32 and every
+    other number as a float32 feature for the columnar
+    formats, so an integer metric keeps one type whether
+    or not a table or batch has fractions or gaps
+    """
+    df = df.copy()
+    for col in df.columns:
+        values = df[col]
+        if col == 'chrom':
+            df[col] = values.astype(str).astype('category')
+        elif values.dtype == object and pd.api.types.infer_dtype(values) in NUMERIC_OBJECTS:
+            # raw_dp holds True for probes without reads
+            df[col] = values.astype(np.float32)
+        elif pd.api.types.is_float_dtype(values):
+            df[col] = values.astype(np.float32)
+        elif col in POSITION_COLUMNS and pd.api.types.is_integer_dtype(values):
+            if not len(values) or values.max() <= INT32_MAX:
+                df[col] = values.astype(np.int32)
+        elif pd.api.types.is_integer_dtype(values):
+            df[col] = values.astype(np.float32)
+    return df
+
+
+def write_table(df, filename, table_format='csv', sep=',', row_group_size=None):
+    if table_format == 'csv':
+        df.to_csv(filename, sep=sep, index=False)
+        return
+    pa = _arrow()
+    table = pa.Table.from_pandas(typed_frame(df), preserve_index=False)
+    if table_format == 'parquet':
+        pa.parquet.write_table(table, filename, row_group_size=row_group_size)
+    else:
+        pa.feather.write_feather(table, filename)
+
+
+def read_table(filename, sep=',', columns=None, filters=None, **kwargs):
+    """
+    table in the format given by its suffix, extra
+    keyword arguments go to read_csv for text tables,
+    filters are pushed down into parquet row groups
+    """
+    table_format = table_format_of(filename)
+    if filters is not None and table_format != 'parquet':
+        raise ValueError("row filters need a parquet table, got {0}".format(filename))
+    if table_format == 'csv':
+        return pd.read_csv(filename, sep=sep, usecols=columns, **kwargs)
+    pa = _arrow()
+    if table_format == 'parquet':
+        table = pa.parquet.read_table(filename, columns=columns, filters=filters)
+    else:
+        table = pa.feather.read_table(filename, columns=columns)
+    return table.to_pandas()
+
+
+def iter_table(filename, chunksize=CHUNK_ROWS, sep=',', columns=None):
+    """
+    frames of at most chunksize rows, feather files yield
+    their record batches from a memory map
+    """
+    table_format = table_format_of(filename)
+    if table_format == 'csv':
+        for chunk in pd.read_csv(filename, sep=sep, usecols=columns, chunksize=chunksize):
+            yield chunk
+        return
+    pa = _arrow()
+    if table_format == 'parquet':
+        for batch in pa.parquet.ParquetFile(filename).iter_batches(batch_size=chunksize,
+                                                                   columns=columns):
+            yield batch.to_pandas()
+        return
+    reader = pa.ipc.open_file(pa.memory_map(filename))
+    for n in range(reader.num_record_batches):
+        batch = reader.get_batch(n)
+        if columns is not None:
+            batch = batch.select(columns)
+        yield batch.to_pandas()
+
+
+class TableWriter(object):
+    """
+    appends frames of the same columns to one table,
+    the columnar formats take the types of the first
+    frame so every batch shares one schema, numbers are
+    typed as in typed_frame, categories only grow so
+    feather batches carry dictionary deltas
+    """
+
+    def __init__(self, filename, table_format='csv', sep=','):
+        self.filename = filename
+        self.table_format = table_format
+        self.sep = sep
+        self.schema = None
+        self.categories = {}
+        self._writer = None
+        self._fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, df):
+        if self.table_format == 'csv':
+            if self._fh is None:
+                self._fh = open(self.filename, 'w')
+                df.to_csv(self._fh, sep=self.sep, header=True, index=False)
+            else:
+                df.to_csv(self._fh, sep=self.sep, header=False, index=False)
+            return
+        pa = _arrow()
+        df = typed_frame(df)
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                known = self.categories.get(col, pd.Index([]))
+                known = known.append(df[col].cat.categories.difference(known))
+                self.categories[col] = known
+                df[col] = df[col].cat.set_categories(known)
+        if self.schema is None:
+            self.schema = pa.Schema.from_pandas(df, preserve_index=False)
+            if self.table_format == 'parquet':
+                self._writer = pa.parquet.ParquetWriter(self.filename, self.schema)
+            else:
+                options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+                self._writer = pa.ipc.new_file(self.filename, self.schema,
+                                               options=options)
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -14,12 +14,14 @@ setup(
     author='Rohan Gnanaolivu',
     author_email='gnanaolivu.rohandavidg@mayo.edu',
     license='MIT',
-    packages=['bed', 'bam'],
+    packages=['bed', 'bam', 'pipeline', 'model', 'features'],
+    package_data={'model': ['*.joblib', '*.pkl'],
+                  'features': ['*.list']},
     scripts=[
-        'bin/prerocessing.py',
         'bin/train.py',
-        'bin/model.py',
-        'bin/inference.py'
+        'bin/inference.py',
+        'bin/score_server.py',
+        'bin/clinray'
     ],
     install_requires=requires,
     zip_safe=False,
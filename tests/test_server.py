@@ -0,0 +1,222 @@
+"""
+scoring server against a local client over a unix socket
+"""
+
+import asyncio
+import contextlib
+import os
+import threading
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from model.inference import DEFAULT_COLUMNS, HomologyModel, read_list
+from model.server import ScoringClient, ScoringServer
+
+
+@pytest.fixture(scope='module')
+def model():
+    with warnings.catch_warnings():
+        # the shipped model and scaler were pickled by newer versions
+        warnings.simplefilter('ignore')
+        return HomologyModel()
+
+
+@contextlib.contextmanager
+def serving(server, path):
+    """
+    run a scoring server on a unix socket in a thread
+    """
+    started = threading.Event()
+    handle = {}
+
+    def ready(listener):
+        handle['loop'] = asyncio.get_running_loop()
+        handle['listener'] = listener
+        started.set()
+
+    def serve():
+        try:
+            asyncio.run(server.serve(socket_path=path, ready=ready))
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    assert started.wait(30)
+    try:
+        yield path
+    finally:
+        handle['loop'].call_soon_threadsafe(handle['listener'].close)
+        thread.join(10)
+
+
+@pytest.fixture(scope='module')
+def socket_path(model, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('server') / 'score.sock')
+    with serving(ScoringServer(model), path):
+        yield path
+
+
+@pytest.fixture
+def client(socket_path):
+    client = ScoringClient(socket_path=socket_path)
+    yield client
+    client.close()
+
+
+def feature_frame(n_rows, seed=0):
+    columns = read_list(DEFAULT_COLUMNS)
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.random((n_rows, len(columns))), columns=columns)
+
+
+def test_score_matches_model(model, client):
+    df = feature_frame(50)
+    probs = client.score(df)
+    assert probs.shape == (50,)
+    np.testing.assert_allclose(probs, model.score_frame(df)['prob_pred_1'], rtol=1e-6)
+
+
+def test_rows_payload(model, client):
+    df = feature_frame(3, seed=1)
+    result = client._request('POST', '/score', {'rows': df.to_dict(orient='records')})
+    np.testing.assert_allclose(result['prob_pred_1'], model.score_frame(df)['prob_pred_1'],
+                               rtol=1e-6)
+
+
+def test_raw_dp_true(model, client):
+    df = feature_frame(2, seed=2)
+    if 'raw_dp' not in df.columns:
+        pytest.skip("model does not use raw_dp")
+    df['raw_dp'] = df['raw_dp'].astype(object)
+    df.loc[0, 'raw_dp'] = 'True'
+    assert client.score(df).shape == (2,)
+
+
+@pytest.mark.parametrize('payload', [{'rows': [1, 2]},
+                                     {'rows': 'abc'},
+                                     {'columns': ['a'], 'data': [1]},
+                                     {'data': []},
+                                     [1, 2]])
+def test_bad_payload(client, payload):
+    with pytest.raises(ValueError):
+        client._request('POST', '/score', payload)
+    # the connection is still served after the error
+    assert client.stats()['errors'] >= 1
+
+
+def test_non_numeric_feature(client):
+    df = feature_frame(2, seed=3).astype(object)
+    df.iloc[0, 0] = 'abc'
+    with pytest.raises(ValueError, match='non numeric'):
+        client.score(df)
+
+
+def test_missing_feature(client):
+    df = feature_frame(2, seed=4).iloc[:, 1:]
+    with pytest.raises(ValueError, match='missing model features'):
+        client.score(df)
+
+
+def test_unknown_endpoint(client):
+    with pytest.raises(ValueError, match='unknown endpoint'):
+        client._request('GET', '/nothing')
+
+
+def test_concurrent_requests(model, socket_path):
+    frames = [feature_frame(10, seed=n) for n in range(8)]
+    results = [None] * len(frames)
+
+    def score(n):
+        client = ScoringClient(socket_path=socket_path)
+        results[n] = client.score(frames[n])
+        client.close()
+
+    threads = [threading.Thread(target=score, args=(n,)) for n in range(len(frames))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    for df, probs in zip(frames, results):
+        np.testing.assert_allclose(probs, model.score_frame(df)['prob_pred_1'], rtol=1e-6)
+    assert os.path.exists(socket_path)
+
+
+class FailingModel(object):
+    """
+    the real model whose next prediction or feature
+    matrix raises once
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.fail = None
+
+    def feature_matrix(self, df):
+        if self.fail == 'features':
+            self.fail = None
+            raise RuntimeError("feature matrix failed")
+        return self.model.feature_matrix(df)
+
+    def predict_matrix(self, matrix):
+        if self.fail == 'predict':
+            self.fail = None
+            raise RuntimeError("prediction failed")
+        return self.model.predict_matrix(matrix)
+
+
+@pytest.mark.parametrize('stage', ['features', 'predict'])
+def test_failing_model(model, tmp_path, stage):
+    failing = FailingModel(model)
+    with serving(ScoringServer(failing), str(tmp_path / 'fail.sock')) as path:
+        client = ScoringClient(socket_path=path, timeout=30)
+        df = feature_frame(5, seed=5)
+        failing.fail = stage
+        with pytest.raises(ValueError, match='RuntimeError'):
+            client.score(df)
+        # the batch loop is still running and answers the next request
+        np.testing.assert_allclose(client.score(df), model.score_frame(df)['prob_pred_1'],
+                                   rtol=1e-6)
+        assert client.stats()['errors'] == 1
+        client.close()
+
+
+def test_cancelled_request_skipped(model):
+    server = ScoringServer(model)
+    df = feature_frame(4, seed=6)
+
+    async def batch():
+        loop = asyncio.get_running_loop()
+        gone, waiting = loop.create_future(), loop.create_future()
+        gone.cancel()
+        await server.score_batch([(df, gone), (df, waiting)], 2 * len(df))
+        return waiting.result()
+
+    np.testing.assert_allclose(asyncio.run(batch()), model.score_frame(df)['prob_pred_1'],
+                               rtol=1e-6)
+    assert server.stats.batches == 1
+
+
+def test_requests_share_batches(model, tmp_path):
+    frames = [feature_frame(10, seed=n) for n in range(8)]
+    barrier = threading.Barrier(len(frames))
+    # a wide window so the concurrent requests land in one batch
+    with serving(ScoringServer(model, window=0.5), str(tmp_path / 'batch.sock')) as path:
+
+        def score(n):
+            client = ScoringClient(socket_path=path)
+            barrier.wait(30)
+            client.score(frames[n])
+            client.close()
+
+        threads = [threading.Thread(target=score, args=(n,)) for n in range(len(frames))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        client = ScoringClient(socket_path=path)
+        stats = client.stats()
+        client.close()
+    assert stats['requests'] == len(frames)
+    assert stats['batches'] < stats['requests']